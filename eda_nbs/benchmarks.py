@@ -0,0 +1,325 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import plots
+import stat_tests
+import text
+import utils
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+# Videos of popular and unpopular channels in the real category datasets (see data.txt),
+# each collected from the top and bottom 25 channels of the category
+CATEGORY_SHAPES = {
+    'autos': (6098, 7497),
+    'shows': (7001, 6295),
+    'travel': (5701, 4109),
+    'sports': (7184, 6959),
+    'tech': (4824, 6355),
+}
+CHANNELS_PER_GROUP = 25
+
+PERCENTILES = ['.25', '.5', '.75', '.9', '.95', '.99']
+TAG_WORDS = ['review', 'test drive', 'vlog', 'travel', 'football', 'highlights',
+             'tech', 'unboxing', 'tutorial', 'episode', 'news', 'live', 'shorts']
+
+
+def synthetic_videos(n_rows: int, pop: bool, n_channels: int = CHANNELS_PER_GROUP, first_year: int = 2008, last_year: int = 2023, seed: int = 0) -> pd.DataFrame:
+    """
+    Deterministic raw video frame shaped like a *_vid.csv dump, i.e. before parse_cols.
+
+    Parameters:
+    - n_rows: Number of videos.
+    - pop: True for popular channels (more views per video), False for unpopular ones.
+    - n_channels: Number of channels, their sizes follow a Zipf like distribution.
+    - first_year, last_year: Range of publishing years, recent years have more uploads.
+    - seed: Seed of the random generator, the same arguments always give the same frame.
+
+    Views are log-normal around a per channel median, so every channel and year has a
+    long right tail like the real data. A few rows have an unparseable publishedAt,
+    a non-numeric viewCount or zero views so every parsing branch is exercised.
+    """
+    rng = np.random.default_rng([seed, int(pop)])
+    prefix = 'Top' if pop else 'Bottom'
+
+    # Channel sizes and median views
+    channels = np.array([f'{prefix} Channel {i}' for i in range(n_channels)])
+    channel_weights = 1 / np.arange(1, n_channels + 1) ** 0.8
+    channel = rng.choice(n_channels, n_rows, p=channel_weights / channel_weights.sum())
+    channel_median = rng.normal(12 if pop else 8, 1.0, n_channels)
+    views = np.exp(rng.normal(channel_median[channel], 1.5)).astype('int64')
+
+    # Publishing times, skewed towards recent years
+    start = pd.Timestamp(f'{first_year}-01-01').value // 10**9
+    end = pd.Timestamp(f'{last_year}-12-31').value // 10**9
+    seconds = start + (rng.beta(2.0, 1.2, n_rows) * (end - start)).astype('int64')
+    published = pd.Series(pd.to_datetime(seconds, unit='s')).dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # ISO-8601 durations, hours only for the long videos
+    duration_secs = rng.gamma(2.0, 300.0, n_rows).astype('int64') + 1
+    hours, rest = np.divmod(duration_secs, 3600)
+    minutes, secs = np.divmod(rest, 60)
+    hours_part = np.where(hours > 0, pd.Series(hours).astype(str) + 'H', '')
+    duration = 'PT' + pd.Series(hours_part) + pd.Series(minutes).astype(str) + 'M' \
+        + pd.Series(secs).astype(str) + 'S'
+
+    # Tags come from a pool of lists since channels reuse them, some videos have none
+    tag_pool = np.array([str([f'{TAG_WORDS[(i + j) % len(TAG_WORDS)]} {i}' for j in range(i % 15 + 1)])
+                         for i in range(2_000)], dtype=object)
+    tags = pd.Series(tag_pool[rng.integers(0, len(tag_pool), n_rows)])
+    tags[rng.random(n_rows) < 0.1] = np.nan
+
+    title_words = pd.Series(TAG_WORDS)[rng.integers(0, len(TAG_WORDS), n_rows)].to_numpy()
+    title = pd.Series(title_words) + ' video ' + pd.Series(np.arange(n_rows)).astype(str) \
+        + ' ' + pd.Series(['!' * k for k in range(40)])[rng.integers(0, 40, n_rows)].to_numpy()
+
+    df = pd.DataFrame({
+        'video_id': pd.Series(np.arange(n_rows)).astype(str).radd(f'{prefix[0]}{seed}_'),
+        'channelTitle': channels[channel],
+        'title': title,
+        'description': 'description',
+        'tags': tags,
+        'publishedAt': published,
+        'viewCount': views.astype(object),
+        'likeCount': (views * rng.uniform(0.005, 0.05, n_rows)).astype('int64'),
+        'commentCount': (views * rng.uniform(0.0005, 0.005, n_rows)).astype('int64'),
+        'duration': duration,
+        'definition': np.where(rng.random(n_rows) < 0.97, 'hd', 'sd'),
+        'caption': rng.random(n_rows) < 0.2,
+    })
+
+    # A few broken rows, like the ones the parser reports dropping
+    broken = rng.choice(n_rows, size=min(n_rows, 3), replace=False)
+    if len(broken) == 3:
+        df.loc[broken[0], 'publishedAt'] = 'not a date'
+        df.loc[broken[1], 'viewCount'] = 'not a number'
+        df.loc[broken[2], 'viewCount'] = 0
+
+    # Round trip through csv so the column dtypes are the ones read_csv gives the notebooks
+    buffer = io.StringIO()
+    df.to_csv(buffer)
+    buffer.seek(0)
+    with warnings.catch_warnings():
+        # viewCount mixes numbers and strings like the real dumps do
+        warnings.simplefilter('ignore', pd.errors.DtypeWarning)
+        return pd.read_csv(buffer, index_col=0)
+
+
+def synthetic_category(pop_rows: int, unpop_rows: int, seed: int = 0):
+    """
+    Raw frames of the popular and unpopular channels of one synthetic category
+    """
+    return (synthetic_videos(pop_rows, True, seed=seed),
+            synthetic_videos(unpop_rows, False, seed=seed))
+
+
+def parsed_frame(top_raw: pd.DataFrame, bottom_raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Combined and parsed frame the analysis functions run on
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        top = utils.add_pop_unpop_col(utils.parse_cols_vectorized(top_raw.copy()), True)
+        bottom = utils.add_pop_unpop_col(
+            utils.parse_cols_vectorized(bottom_raw.copy()), False)
+    return utils.combine_pop_unpop_df(top, bottom)
+
+
+def app_callbacks(app) -> dict:
+    """
+    Undecorated callback functions of a Dash app by output id
+    """
+    callbacks = {}
+    for output, value in app.callback_map.items():
+        function = value['callback']
+        while hasattr(function, '__wrapped__'):
+            function = function.__wrapped__
+        callbacks[output] = function
+    return callbacks
+
+
+def dash_inputs(df: pd.DataFrame):
+    """
+    Callback inputs with every channel and year selected, the heaviest interaction
+    """
+    popular = df.loc[df['pop_unpop'] == 1, 'channelTitle'].unique().tolist()
+    unpopular = df.loc[df['pop_unpop'] == 0, 'channelTitle'].unique().tolist()
+    years = df['publishingYear'].unique().tolist()
+    return popular, unpopular, years
+
+
+def callback_benchmark(build_app, output_prefix, make_args):
+    """
+    Benchmark of one callback: the app is built in the setup, only the callback body is timed
+    """
+    def setup(data):
+        app = build_app(data['parsed'])
+        callback = next(function for output, function in app_callbacks(app).items()
+                        if output.startswith(output_prefix))
+        return (callback, *make_args(data['parsed']))
+
+    return setup, lambda callback, *args: callback(*args)
+
+
+# name -> (setup building the arguments from the data, function that is measured)
+BENCHMARKS = {
+    'parse_cols': (lambda data: (data['raw'].copy(),), utils.parse_cols),
+    'parse_cols_vectorized': (lambda data: (data['raw'].copy(),), utils.parse_cols_vectorized),
+    'remove_outliers': (lambda data: (data['parsed'],), utils.remove_outliers),
+    'calculate_percentiles_df': (lambda data: (data['parsed'], PERCENTILES), utils.calculate_percentiles_df),
+    'pop_unpop_chunks': (lambda data: (data['parsed'],), utils.pop_unpop_chunks),
+    'compare_pop_unpop': (lambda data: (data['parsed'],), stat_tests.compare_pop_unpop),
+    'tokenize': (lambda data: (data['raw']['title'],), text.tokenize),
+    'term_frequencies': (lambda data: (data['raw']['title'],), text.term_frequencies),
+    'dynamic_view_plots.build': (lambda data: (data['parsed'],), plots.dynamic_view_plots),
+    'dynamic_view_plots.update_bar_plots': callback_benchmark(
+        plots.dynamic_view_plots, '..bar-plot-a',
+        lambda df: (*dash_inputs(df), 'viewCount')),
+    'dynamic_view_plots.update_line_plots': callback_benchmark(
+        plots.dynamic_view_plots, '..line-plot-a',
+        lambda df: (*dash_inputs(df), 'viewCount')),
+    'percentiles_plot.update_percentiles_plot': callback_benchmark(
+        lambda df: plots.percentiles_plot(df, PERCENTILES, cache_size=0), '..line-plot-pr',
+        lambda df: dash_inputs(df)[:2]),
+}
+
+
+def measure(setup, function, data, repeat: int = 3) -> dict:
+    """
+    Best and mean wall time over repeat runs plus the peak traced memory of one run.
+    setup runs before every call and is not included in the time or memory.
+    """
+    runs = []
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        # parse_cols warns about chained assignment on every call
+        warnings.simplefilter('ignore')
+        for _ in range(repeat):
+            args = setup(data)
+            start = time.perf_counter()
+            function(*args)
+            runs.append(time.perf_counter() - start)
+
+        # Memory is measured separately since tracing slows the calls down
+        args = setup(data)
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {'best_secs': min(runs), 'mean_secs': float(np.mean(runs)),
+            'runs': runs, 'peak_mb': peak / 1e6}
+
+
+def benchmark_shapes(sizes=SIZES, categories=None):
+    """
+    (shape name, popular rows, unpopular rows) of every synthetic size and real category shape
+    """
+    shapes = [(f'{size}', size // 2, size - size // 2) for size in sizes]
+    categories = CATEGORY_SHAPES if categories is None else categories
+    shapes += [(name, *CATEGORY_SHAPES[name]) for name in categories]
+    return shapes
+
+
+def run_benchmarks(functions=None, sizes=SIZES, categories=None, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Time every benchmark on every shape and return the results with run metadata.
+
+    Parameters:
+    - functions: Optional list of BENCHMARKS names, all by default.
+    - sizes: Row counts of the synthetic datasets.
+    - categories: Optional list of CATEGORY_SHAPES names, all by default.
+    - repeat: Number of timed runs per function and shape.
+    - seed: Seed of the synthetic data.
+    """
+    functions = list(BENCHMARKS) if functions is None else functions
+    results = []
+    for shape, pop_rows, unpop_rows in benchmark_shapes(sizes, categories):
+        top_raw, bottom_raw = synthetic_category(pop_rows, unpop_rows, seed)
+        data = {'raw': pd.concat([top_raw, bottom_raw], ignore_index=True),
+                'parsed': parsed_frame(top_raw, bottom_raw)}
+
+        for name in functions:
+            setup, function = BENCHMARKS[name]
+            result = {'function': name, 'shape': shape, 'rows': pop_rows + unpop_rows}
+            result.update(measure(setup, function, data, repeat))
+            results.append(result)
+            print(f"{name:45} {shape:>8} {result['best_secs']:10.4f}s {result['peak_mb']:10.1f} MB")
+
+    return {'meta': run_metadata(repeat, seed), 'results': results}
+
+
+def run_metadata(repeat: int, seed: int) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'seed': seed,
+    }
+
+
+def compare_results(baseline: dict, results: dict) -> pd.DataFrame:
+    """
+    Ratio of the best time and peak memory of results to a baseline run,
+    values above 1 mean the new version is slower or uses more memory
+    """
+    keys = ['function', 'shape']
+    old = pd.DataFrame(baseline['results']).set_index(keys)[['best_secs', 'peak_mb']]
+    new = pd.DataFrame(results['results']).set_index(keys)[['best_secs', 'peak_mb']]
+    table = old.join(new, how='inner', lsuffix='_baseline')
+    table['time_ratio'] = table['best_secs'] / table['best_secs_baseline']
+    table['memory_ratio'] = table['peak_mb'] / table['peak_mb_baseline']
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the utils.py and plots.py hot paths on synthetic video data')
+    parser.add_argument('--functions', nargs='+', choices=list(BENCHMARKS), default=None,
+                        help='Functions to benchmark (default: all)')
+    parser.add_argument('--sizes', nargs='*', type=int, default=SIZES,
+                        help='Row counts of the synthetic datasets')
+    parser.add_argument('--categories', nargs='*', choices=list(CATEGORY_SHAPES), default=None,
+                        help='Real category shapes to include (default: all)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file the results are written to')
+    parser.add_argument('--baseline', default=None,
+                        help='Results JSON of an earlier version to compare against')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.functions, args.sizes, args.categories,
+                             args.repeat, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(compare_results(baseline, results).round(3).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+import fileio
+
+
+class LRUBackend:
+    """
+    In-process cache of the most recently used callback results, shared by all
+    sessions served by the same Dash process.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return (True, value) for a cached key and (False, None) otherwise
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DiskBackend:
+    """
+    Cache of callback results stored as JSON files in a local directory, shared by every
+    process (e.g. several server workers or notebooks) that points to the same directory.
+
+    Results are encoded like Dash encodes callback responses, so hits return plain
+    dicts and lists instead of plotly objects. Reading them back skips the validation
+    plotly runs when figure objects are built or unpickled.
+
+    Entries are stored in one subdirectory per dataset version. The first entry of a new
+    version drops the subdirectories of all other versions, so only the figures of the
+    latest dataset are kept on disk.
+    """
+
+    def __init__(self, directory='figure_cache'):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def version_directory(self, version):
+        return os.path.join(self.directory, hashlib.sha256(str(version).encode()).hexdigest()[:16])
+
+    def path(self, key):
+        version, digest = key
+        return os.path.join(self.version_directory(version), f'{digest}.json')
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, value
+
+    def set(self, key, value):
+        version_directory = self.version_directory(key[0])
+        if not os.path.isdir(version_directory):
+            os.makedirs(version_directory, exist_ok=True)
+            self.drop_other_versions(version_directory)
+
+        # Write to a temporary file first so readers never see a partial file. Another
+        # process may drop the version meanwhile, the value is then just not cached.
+        try:
+            with fileio.atomic_path(self.path(key)) as tmp_path, open(tmp_path, 'w') as f:
+                json.dump(value, f, cls=PlotlyJSONEncoder)
+        except FileNotFoundError:
+            pass
+
+    def drop_other_versions(self, version_directory):
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.path != version_directory:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+
+def dataset_version(df: pd.DataFrame) -> str:
+    """
+    Content hash of a frame, cached results are only reused for the same version.
+    Columns holding unhashable values (e.g. tagsList) are hashed as strings.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((df.shape, list(df.columns), [str(dtype) for dtype in df.dtypes])).encode())
+    for column in df.columns:
+        try:
+            hashes = pd.util.hash_pandas_object(df[column], index=False)
+        except TypeError:
+            hashes = pd.util.hash_pandas_object(df[column].astype(str), index=False)
+        digest.update(hashes.to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(df.index).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def normalize_input(value):
+    """
+    Callback input in a canonical form: lists (channels, years) become sorted tuples
+    without duplicates and numpy scalars become Python scalars
+    """
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        return tuple(sorted({normalize_input(item) for item in value}, key=repr))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def memoize(backend, version: str):
+    """
+    Decorator factory caching callback results in backend, keyed on the dataset version
+    and a hash of the callback name and the normalized inputs.
+
+    Usage:
+        cached = callback_cache.memoize(LRUBackend(), dataset_version(df))
+
+        @app.callback(...)
+        @cached('my_app.update_plot')
+        def update_plot(selected_channels, selected_years):
+            ...
+    """
+    def named(name):
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args):
+                key_inputs = (name, tuple(normalize_input(arg) for arg in args))
+                key = (version, hashlib.sha256(pickle.dumps(key_inputs)).hexdigest())
+
+                hit, value = backend.get(key)
+                if hit:
+                    return value
+                value = function(*args)
+                backend.set(key, value)
+                return value
+
+            return wrapper
+
+        return decorator
+
+    return named
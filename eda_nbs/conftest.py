@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other by name (import utils), as when run from eda_nbs
+sys.path.insert(0, os.path.dirname(__file__))
@@ -0,0 +1,393 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import isodate
+import pandas as pd
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+import fileio
+
+# Environment variables holding the YouTube Data API keys used in the notebooks
+API_KEY_ENV_VARS = ['yt_1', 'yt_2', 'yt_3', 'db_api_1']
+
+# Every key gets 10k quota units per day, each list call below costs 1 unit
+DAILY_QUOTA = 10_000
+LIST_COST = 1
+
+# The API resets the quota of every key at midnight Pacific Time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+# Maximum number of ids the API accepts per channels/videos list call
+BATCH_SIZE = 50
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when no API key has quota left for another request.
+    """
+
+
+def quota_day():
+    """
+    Current quota day, the date in QUOTA_TIMEZONE
+    """
+    return datetime.now(QUOTA_TIMEZONE).date()
+
+
+class TokenBucket:
+    """
+    Quota budget of one API key for the current quota day: refilled to capacity when a
+    new quota day starts, so at most capacity units are spent per day. Units spent
+    with the same key by other processes earlier that day are not known.
+    """
+
+    def __init__(self, capacity=DAILY_QUOTA):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.day = quota_day()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, cost=LIST_COST):
+        with self.lock:
+            today = quota_day()
+            if today != self.day:
+                self.tokens = self.capacity
+                self.day = today
+            if self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+    def drain(self):
+        """
+        Spend the rest of today's quota, e.g. when the API reports it as exceeded
+        """
+        with self.lock:
+            self.tokens = 0
+            self.day = quota_day()
+
+
+class KeyPool:
+    """
+    Rotates requests across several API keys, each with its own TokenBucket.
+
+    googleapiclient clients are not thread safe, so every worker thread builds its own
+    client per key. api_endpoint points the clients at another server, e.g. a local fake API.
+    """
+
+    def __init__(self, api_keys, quota=DAILY_QUOTA, api_endpoint=None):
+        if not api_keys:
+            raise ValueError("At least one API key is required")
+        self.api_keys = list(api_keys)
+        self.buckets = [TokenBucket(quota) for _ in self.api_keys]
+        self.api_endpoint = api_endpoint
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def client(self, key_index):
+        clients = self.local.__dict__.setdefault('clients', {})
+        if key_index not in clients:
+            client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+            clients[key_index] = build('youtube', 'v3', developerKey=self.api_keys[key_index],
+                                       client_options=client_options, cache_discovery=False)
+        return clients[key_index]
+
+    def execute(self, make_request, cost=LIST_COST):
+        """
+        Execute make_request(youtube) with the next key that still has quota.
+        A key that the API reports as out of quota is drained and the request moves on.
+        """
+        with self.lock:
+            start = self.next_key
+            self.next_key = (self.next_key + 1) % len(self.api_keys)
+
+        for offset in range(len(self.api_keys)):
+            key_index = (start + offset) % len(self.api_keys)
+            if not self.buckets[key_index].try_acquire(cost):
+                continue
+            try:
+                return make_request(self.client(key_index)).execute()
+            except HttpError as e:
+                if e.resp.status == 403 and b'quotaExceeded' in e.content:
+                    self.buckets[key_index].drain()
+                    continue
+                raise
+
+        raise QuotaExceeded("All API keys are out of quota")
+
+
+def api_keys_from_env(env_vars=API_KEY_ENV_VARS):
+    """
+    Collect the distinct API keys that are set in the given environment variables.
+    """
+    keys = [os.environ.get(var) for var in env_vars]
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+def get_channel_stats(channel_ids, pool):
+    """
+    Get Channel statistics: title subscriber count, view count, video count, upload playlist
+
+    Params:
+    channel_ids: list of channel IDs
+    pool: KeyPool used to send the requests
+
+    Returns:
+    Dataframe containing the channel statistics for all channels in the provided list
+    """
+    all_data = []
+    for i in range(0, len(channel_ids), BATCH_SIZE):
+        response = pool.execute(lambda yt: yt.channels().list(
+            part='snippet,contentDetails,statistics,brandingSettings',
+            id=','.join(channel_ids[i:i + BATCH_SIZE])))
+
+        for item in response.get('items', []):
+            all_data.append(dict(channelName=item['snippet']['title'],
+                                 subscribers=item['statistics']['subscriberCount'],
+                                 views=item['statistics']['viewCount'],
+                                 totalVideos=item['statistics']['videoCount'],
+                                 playlistId=item['contentDetails']['relatedPlaylists']['uploads'],
+                                 publishedAt=isodate.parse_datetime(item['snippet']['publishedAt'])))
+
+    return pd.DataFrame(all_data)
+
+
+def reached_high_water_mark(item, high_water_mark):
+    """
+    Whether a playlist item is at or behind the newest video seen by the previous sync.
+    """
+    if high_water_mark is None:
+        return False
+    if item['contentDetails']['videoId'] == high_water_mark['video_id']:
+        return True
+    published_at = item['contentDetails'].get('videoPublishedAt')
+    return published_at is not None and (isodate.parse_datetime(published_at) <=
+                                         isodate.parse_datetime(high_water_mark['publishedAt']))
+
+
+def get_video_ids(playlist_id, pool, max_results=1000, high_water_mark=None):
+    """
+    Get list of video IDs of all videos in the given playlist, up to max_results videos.
+    Pages of one playlist depend on each other, so they are fetched one after another.
+
+    Params:
+    playlist_id: playlist ID of the channel
+    pool: KeyPool used to send the requests
+    max_results: maximum number of videos to retrieve (default: 1000)
+    high_water_mark: optional {'video_id', 'publishedAt'} of the newest video already
+        fetched, paging stops as soon as that video (or an older one) is reached
+
+    Returns:
+    List of video IDs, newest first
+    """
+    video_ids = []
+    next_page_token = None
+
+    while len(video_ids) < max_results:
+        response = pool.execute(lambda yt: yt.playlistItems().list(
+            part='contentDetails',
+            playlistId=playlist_id,
+            maxResults=min(max_results - len(video_ids), BATCH_SIZE),
+            pageToken=next_page_token))
+
+        for item in response.get('items', []):
+            if reached_high_water_mark(item, high_water_mark):
+                return video_ids
+            video_ids.append(item['contentDetails']['videoId'])
+
+        next_page_token = response.get('nextPageToken')
+        if next_page_token is None:
+            break
+
+    return video_ids[:max_results]
+
+
+def get_video_batch(video_ids, pool):
+    response = pool.execute(lambda yt: yt.videos().list(
+        part='snippet,contentDetails,statistics',
+        id=','.join(video_ids)))
+
+    stats_to_keep = {'snippet': ['channelTitle', 'title', 'description', 'tags', 'publishedAt'],
+                     'statistics': ['viewCount', 'likeCount', 'commentCount'],
+                     'contentDetails': ['duration', 'definition', 'caption']
+                     }
+    batch_info = []
+    for video in response.get('items', []):
+        video_info = {'video_id': video['id']}
+        for k, columns in stats_to_keep.items():
+            for v in columns:
+                video_info[v] = video.get(k, {}).get(v)
+        batch_info.append(video_info)
+    return batch_info
+
+
+def get_video_details(video_ids, pool, workers=8):
+    """
+    Get video statistics of all videos with given IDs, requesting batches of 50 in parallel.
+
+    Params:
+    video_ids: list of video IDs
+    pool: KeyPool used to send the requests
+    workers: number of concurrent requests
+
+    Returns:
+    Dataframe with statistics of videos, i.e.:
+        'channelTitle', 'title', 'description', 'tags', 'publishedAt'
+        'viewCount', 'likeCount', 'commentCount'
+        'duration', 'definition', 'caption'
+    """
+    batches = [video_ids[i:i + BATCH_SIZE]
+               for i in range(0, len(video_ids), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda batch: get_video_batch(batch, pool), batches)
+        all_video_info = [info for batch_info in results for info in batch_info]
+
+    return pd.DataFrame(all_video_info)
+
+
+def get_video_comments(video_id, pool, max_comments=10):
+    try:
+        response = pool.execute(lambda yt: yt.commentThreads().list(
+            part='snippet,replies',
+            videoId=video_id))
+    except QuotaExceeded:
+        raise
+    except Exception:
+        # When error occurs - most likely because comments are disabled on a video
+        print('Could not get comments for video ' + video_id)
+        return None
+
+    comments_in_video = [comment['snippet']['topLevelComment']['snippet']['textOriginal']
+                         for comment in response.get('items', [])[0:max_comments]]
+    return {'video_id': video_id, 'comments': comments_in_video}
+
+
+def get_comments_in_videos(video_ids, pool, workers=8):
+    """
+    Get top level comments as text from all videos with given IDs (only the first 10
+    comments due to the quota limit of the Youtube API), one request per video in parallel.
+
+    Params:
+    video_ids: list of video IDs
+    pool: KeyPool used to send the requests
+    workers: number of concurrent requests
+
+    Returns:
+    Dataframe with video IDs and associated top level comment in text.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda video_id: get_video_comments(video_id, pool), video_ids)
+        all_comments = [comments for comments in results if comments is not None]
+
+    return pd.DataFrame(all_comments)
+
+
+def fetch_channels(channel_data, pool, max_results=1000, workers=8, comments=True):
+    """
+    Fetch video details (and comments) for every channel in channel_data, the frame
+    returned by get_channel_stats. Playlists are paged concurrently across channels,
+    then details and comments of all videos are fetched with the same worker count.
+
+    Returns:
+    - video_df, comments_df (comments_df is empty when comments is False)
+    """
+    channels = channel_data.drop_duplicates('channelName')
+    for channel in channels['channelName']:
+        print("Getting video information from channel: " + channel)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        playlists = executor.map(
+            lambda playlist_id: get_video_ids(playlist_id, pool, max_results),
+            channels['playlistId'])
+        video_ids = [video_id for ids in playlists for video_id in ids]
+
+    video_df = get_video_details(video_ids, pool, workers)
+    comments_df = get_comments_in_videos(
+        video_ids, pool, workers) if comments else pd.DataFrame()
+
+    return video_df, comments_df
+
+
+def load_sync_state(state_path):
+    """
+    Read the per-playlist high-water marks written by sync_channels, {} if there are none yet.
+    """
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_sync_state(state, state_path):
+    # Write to a temporary file first so an interrupted run can't corrupt the state
+    with fileio.atomic_path(state_path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def sync_channels(channel_data, pool, video_df=None, state_path='sync_state.json', refresh_days=30,
+                  max_results=1000, workers=8, comments=True):
+    """
+    Incremental version of fetch_channels. Only videos newer than the high-water mark
+    stored per playlistId in state_path are listed and fetched, and the statistics of
+    already known videos are re-fetched only for those published in the last refresh_days.
+
+    Params:
+    channel_data: frame returned by get_channel_stats
+    pool: KeyPool used to send the requests
+    video_df: raw video frame of the previous runs (e.g. read from top_tech_vid.csv),
+        without it only the new videos are returned
+    state_path: JSON file holding the high-water mark of every playlist
+    refresh_days: window of recent videos whose statistics are refreshed
+
+    Returns:
+    - video_df with refreshed rows replaced and new videos appended
+    - comments_df with the comments of the new videos only
+    """
+    state = load_sync_state(state_path)
+    channels = channel_data.drop_duplicates('playlistId')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        playlists = list(executor.map(
+            lambda playlist_id: get_video_ids(
+                playlist_id, pool, max_results, state.get(playlist_id)),
+            channels['playlistId']))
+    new_ids = [video_id for ids in playlists for video_id in ids]
+    for channel, ids in zip(channels['channelName'], playlists):
+        print(f"Channel {channel}: {len(ids)} new videos")
+
+    # Known videos of the synced channels that are still inside the refresh window
+    refresh_ids = []
+    if video_df is not None and refresh_days:
+        published_at = pd.to_datetime(video_df['publishedAt'], utc=True, errors='coerce')
+        recent = (published_at >= pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=refresh_days)) & \
+            video_df['channelTitle'].isin(channels['channelName']) & \
+            ~video_df['video_id'].isin(new_ids)
+        refresh_ids = video_df.loc[recent, 'video_id'].tolist()
+    print(f"Refreshing statistics of {len(refresh_ids)} recent videos")
+
+    details = get_video_details(new_ids + refresh_ids, pool, workers)
+    comments_df = get_comments_in_videos(
+        new_ids, pool, workers) if comments else pd.DataFrame()
+
+    if video_df is not None and len(details):
+        video_df = pd.concat([video_df[~video_df['video_id'].isin(details['video_id'])], details],
+                             ignore_index=True)
+    elif video_df is None:
+        video_df = details
+
+    # The newest listed video of every playlist becomes its new high-water mark
+    if len(details):
+        published_at = details.set_index('video_id')['publishedAt']
+        for playlist_id, ids in zip(channels['playlistId'], playlists):
+            if ids and ids[0] in published_at.index:
+                state[playlist_id] = {'video_id': ids[0],
+                                      'publishedAt': published_at[ids[0]]}
+    save_sync_state(state, state_path)
+
+    return video_df, comments_df
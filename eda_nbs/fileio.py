@@ -0,0 +1,27 @@
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    """
+    Temporary path to write a file to, moved over path once the block finishes so
+    readers never see a partial file. The temporary file is unique, hidden (pyarrow
+    datasets skip it) and keeps the extension of path, it is removed if the block fails.
+
+    Usage:
+        with atomic_path('index/matrix.npz') as tmp_path:
+            sparse.save_npz(tmp_path, matrix)
+    """
+    directory, name = os.path.split(path)
+    stem, extension = os.path.splitext(name)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{stem}-', suffix=extension, dir=directory or '.')
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,194 @@
+import cProfile
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from functools import wraps
+
+import pandas as pd
+
+# Instrumentation is off until enable() is called, decorated functions then only pay
+# for one attribute lookup per call
+SETTINGS = {'enabled': False, 'memory': False, 'profile_dir': None, 'log_path': None}
+
+# One dict per finished stage, in the order the stages finished
+RECORDS = []
+
+# Names of the stages that are currently running in each thread, outermost first. Dash
+# callbacks of the threaded server run in parallel, each thread nests its own stages.
+ACTIVE = threading.local()
+
+
+def active_stages() -> list:
+    """
+    Stack of the stages running in the current thread
+    """
+    if not hasattr(ACTIVE, 'stages'):
+        ACTIVE.stages = []
+    return ACTIVE.stages
+
+
+def enable(memory: bool = False, profile_dir: str = None, log_path: str = None) -> None:
+    """
+    Start recording stages.
+
+    Parameters:
+    - memory: Trace allocations with tracemalloc to record the memory delta of every stage
+      and the peak of every outermost stage. Tracing makes the code noticeably slower.
+    - profile_dir: Optional directory a cProfile dump of every outermost stage is written to,
+      as <name>-<number>.prof (open with pstats or snakeviz). Not supported under the
+      threaded server (serve.py run): callbacks running in parallel threads would need
+      several profilers at once, which Python 3.12+ refuses, and their dumps get mixed.
+    - log_path: Optional file every record is appended to as one JSON line.
+    """
+    SETTINGS.update(enabled=True, memory=memory,
+                    profile_dir=profile_dir, log_path=log_path)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def disable() -> None:
+    """
+    Stop recording stages, the records collected so far are kept
+    """
+    if SETTINGS['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    SETTINGS.update(enabled=False, memory=False, profile_dir=None, log_path=None)
+
+
+def reset() -> None:
+    """
+    Drop all collected records
+    """
+    RECORDS.clear()
+
+
+def count_rows(value):
+    """
+    Number of rows of a frame or series, or of all frames in a returned tuple
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, tuple):
+        counts = [len(item) for item in value if isinstance(item, (pd.DataFrame, pd.Series))]
+        return sum(counts) if counts else None
+    return None
+
+
+@contextlib.contextmanager
+def stage(name: str, rows_in=None):
+    """
+    Record the wall time, rows and memory of the wrapped block as one stage.
+
+    Yields the record, set record['rows_out'] inside the block to record the output rows.
+    Does nothing but yield an empty dict while instrumentation is disabled.
+
+    Usage:
+        with instrumentation.stage('read_csv') as record:
+            df = pd.read_csv(path)
+            record['rows_out'] = len(df)
+    """
+    if not SETTINGS['enabled']:
+        yield {}
+        return
+
+    active = active_stages()
+    record = {'stage': name, 'parent': active[-1] if active else None,
+              'depth': len(active), 'rows_in': count_rows(rows_in), 'rows_out': None}
+
+    # Only one profiler can run at a time, so nested stages are part of the outer dump
+    profiler = None
+    if SETTINGS['profile_dir'] is not None and not active:
+        profiler = cProfile.Profile()
+
+    memory = SETTINGS['memory'] and tracemalloc.is_tracing()
+    if memory:
+        memory_before = tracemalloc.get_traced_memory()[0]
+        if not active:
+            tracemalloc.reset_peak()
+
+    active.append(name)
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall_secs'] = time.perf_counter() - start
+        active.pop()
+
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            record['memory_delta_mb'] = (current - memory_before) / 1e6
+            # The peak is reset per outermost stage only, nested stages share it
+            record['memory_peak_mb'] = (peak - memory_before) / 1e6 if not active else None
+
+        if profiler is not None:
+            number = sum(1 for previous in RECORDS if previous['stage'] == name)
+            record['profile'] = os.path.join(
+                SETTINGS['profile_dir'], f'{name}-{number}.prof')
+            profiler.dump_stats(record['profile'])
+
+        RECORDS.append(record)
+        if SETTINGS['log_path'] is not None:
+            with open(SETTINGS['log_path'], 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+
+def instrumented(name: str = None):
+    """
+    Decorator recording every call of a function as a stage named after the function.
+    The rows in are taken from the first DataFrame argument, the rows out from the result.
+    """
+    def decorator(function):
+        stage_name = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not SETTINGS['enabled']:
+                return function(*args, **kwargs)
+
+            frames = [arg for arg in args if isinstance(arg, pd.DataFrame)]
+            with stage(stage_name, frames[0] if frames else None) as record:
+                result = function(*args, **kwargs)
+                record['rows_out'] = count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def records() -> pd.DataFrame:
+    """
+    All recorded stages as a DataFrame, one row per call
+    """
+    return pd.DataFrame(RECORDS)
+
+
+def report() -> pd.DataFrame:
+    """
+    Calls, total and mean wall time, rows and memory per stage, slowest stage first
+    """
+    df = records()
+    if df.empty:
+        return df
+
+    # Stages without frames (e.g. Dash callbacks) keep NaN rows instead of 0
+    def total(values):
+        return values.sum(min_count=1)
+
+    aggregations = {'calls': ('wall_secs', 'size'), 'total_secs': ('wall_secs', 'sum'),
+                    'mean_secs': ('wall_secs', 'mean'), 'rows_in': ('rows_in', total),
+                    'rows_out': ('rows_out', total)}
+    if 'memory_delta_mb' in df.columns:
+        aggregations['memory_delta_mb'] = ('memory_delta_mb', 'sum')
+        aggregations['memory_peak_mb'] = ('memory_peak_mb', 'max')
+
+    return df.groupby('stage').agg(**aggregations).sort_values('total_secs', ascending=False)
@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import fileio
+import text
+from instrumentation import instrumented
+
+# Columns every indexed video is tagged with
+TAG_COLUMNS = ['video_id', 'channelTitle', 'category', 'publishingYear', 'pop_unpop']
+
+# Files of a saved index
+MATRIX_FILE = 'matrix.npz'
+VOCABULARY_FILE = 'vocabulary.json'
+ROWS_FILE = 'rows.parquet'
+SETTINGS_FILE = 'settings.json'
+
+
+class NgramIndex:
+    """
+    Sparse (videos x unigrams and bigrams) count matrix of video titles, with every row
+    tagged by video id, channel, category, year and pop_unpop. Term counts of any
+    subset of videos are then a masked sum over the matrix instead of a new pass over
+    the titles.
+
+    Usage:
+        index = NgramIndex(stop_words=text.english_stopwords())
+        index.add(cleaned_dataframe, 'tech')
+        index.save('title_index')
+
+        index = NgramIndex.load('title_index')
+        index.top_terms(20, categories=['tech'], years=[2022], pop_unpop=1)
+    """
+
+    def __init__(self, stop_words=(), min_length: int = 3, clean: bool = True, lowercase: bool = True, text_column: str = 'title'):
+        self.settings = {'stop_words': sorted(stop_words), 'min_length': min_length,
+                         'clean': clean, 'lowercase': lowercase, 'text_column': text_column}
+        self.stop_words = frozenset(stop_words)
+        self.vocabulary = text.Vocabulary()
+        self.matrix = sparse.csr_matrix((0, 0), dtype='int32')
+        self.rows = pd.DataFrame({column: [] for column in TAG_COLUMNS})
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @instrumented('NgramIndex.add')
+    def add(self, df: pd.DataFrame, category: str = None) -> int:
+        """
+        Index the videos of a parsed frame whose video_id is not indexed yet.
+
+        Parameters:
+        - df: Parsed video frame with the text column and the TAG_COLUMNS, e.g. from
+          remove_outliers or storage.load_videos.
+        - category: Category of all videos, only needed when df has no category column.
+
+        Returns the number of videos added. New terms are appended to the vocabulary,
+        the rows already indexed are not tokenized again.
+        """
+        if category is not None:
+            df = df.assign(category=category)
+        df = df[~df['video_id'].isin(self.rows['video_id'])].drop_duplicates('video_id')
+        if df.empty:
+            return 0
+
+        indptr, ids, _ = text.tokenize(
+            df[self.settings['text_column']], self.stop_words, self.settings['min_length'],
+            self.settings['clean'], self.settings['lowercase'], self.vocabulary)
+        indptr, ids = text.with_bigrams(indptr, ids, self.vocabulary)
+        new_rows = text.document_term_matrix(indptr, ids, self.vocabulary)
+
+        # Older rows get zero columns for the terms that are new in this batch
+        matrix = self.matrix.copy()
+        matrix.resize((matrix.shape[0], len(self.vocabulary)))
+        self.matrix = sparse.vstack([matrix, new_rows], format='csr')
+
+        tags = df[TAG_COLUMNS].astype({'channelTitle': str, 'category': str})
+        self.rows = pd.concat([self.rows, tags], ignore_index=True)
+        self.rows['publishingYear'] = self.rows['publishingYear'].astype('int64')
+        self.rows['pop_unpop'] = self.rows['pop_unpop'].astype('int64')
+        return len(df)
+
+    def mask(self, categories=None, years=None, channels=None, pop_unpop=None) -> np.ndarray:
+        """
+        Boolean mask of the rows matching all given filters (same filters as
+        storage.load_videos)
+        """
+        mask = np.ones(len(self.rows), dtype=bool)
+        if categories is not None:
+            mask &= self.rows['category'].isin(list(categories)).to_numpy()
+        if years is not None:
+            mask &= self.rows['publishingYear'].isin(list(years)).to_numpy()
+        if channels is not None:
+            mask &= self.rows['channelTitle'].isin(list(channels)).to_numpy()
+        if pop_unpop is not None:
+            mask &= self.rows['pop_unpop'].to_numpy() == pop_unpop
+        return mask
+
+    def term_counts(self, ngram: int = None, **filters) -> pd.Series:
+        """
+        Occurrences of every term in the videos matching the filters (see mask), terms
+        that don't occur are left out. ngram=1 or 2 keeps only unigrams or bigrams.
+        """
+        counts = self.mask(**filters).astype('int32') @ self.matrix
+        present = np.flatnonzero(counts)
+        terms = pd.Series(counts[present], index=[self.vocabulary.tokens[i] for i in present])
+
+        if ngram is not None:
+            terms = terms[(terms.index.str.count(' ') + 1) == ngram]
+        return terms
+
+    def top_terms(self, n: int = 20, ngram: int = None, **filters) -> pd.Series:
+        """
+        The n most frequent terms in the videos matching the filters, e.g.
+        index.top_terms(10, ngram=2, categories=['tech'], years=[2022], pop_unpop=1)
+        """
+        return self.term_counts(ngram, **filters).nlargest(n)
+
+    def save(self, directory: str) -> None:
+        """
+        Write the index to a directory, every file is replaced only once fully written
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        def path(name):
+            return os.path.join(directory, name)
+
+        with fileio.atomic_path(path(MATRIX_FILE)) as tmp_path:
+            sparse.save_npz(tmp_path, self.matrix)
+        with fileio.atomic_path(path(ROWS_FILE)) as tmp_path:
+            self.rows.to_parquet(tmp_path, index=False)
+        for name, content in [(VOCABULARY_FILE, self.vocabulary.tokens), (SETTINGS_FILE, self.settings)]:
+            with fileio.atomic_path(path(name)) as tmp_path, open(tmp_path, 'w') as f:
+                json.dump(content, f)
+
+    @classmethod
+    def load(cls, directory: str) -> 'NgramIndex':
+        """
+        Load an index written by save, it can be updated with add and saved again
+        """
+        with open(os.path.join(directory, SETTINGS_FILE)) as f:
+            index = cls(**json.load(f))
+        with open(os.path.join(directory, VOCABULARY_FILE)) as f:
+            index.vocabulary = text.Vocabulary(json.load(f))
+        index.matrix = sparse.load_npz(os.path.join(directory, MATRIX_FILE))
+        index.rows = pd.read_parquet(os.path.join(directory, ROWS_FILE))
+        return index
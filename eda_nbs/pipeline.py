@@ -0,0 +1,220 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+import instrumentation
+import sentiment
+import stat_tests
+import storage
+import topics
+import utils
+
+CATEGORIES = ['autos', 'shows', 'travel', 'sports', 'tech']
+
+# Per channel means compared between popular and unpopular channels
+CHANNEL_MEAN_COLUMNS = ['viewCount', 'likeRatio',
+                        'commentRatio', 'durationSecs', 'titleLength']
+
+
+def average_duration_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Number of videos and average duration in minutes per channel, year and pop_unpop,
+    sorted by average duration within every channel (the <name>_avg_duration.csv table)
+    """
+    grouped_data = df.groupby(['channelTitle', 'publishingYear', 'pop_unpop'], observed=True)[
+        'durationSecs'].agg(['count', 'mean']).reset_index()
+    grouped_data.columns = ['channelTitle', 'publishingYear',
+                            'pop_unpop', 'num_videos', 'average_duration_secs']
+
+    # Convert duration from seconds to minutes
+    grouped_data['average_duration_mins'] = grouped_data['average_duration_secs'] / 60
+    grouped_data.drop(columns=['average_duration_secs'], inplace=True)
+
+    return grouped_data.sort_values(['channelTitle', 'average_duration_mins'],
+                                    kind='stable', ignore_index=True)
+
+
+def read_videos(path: str) -> pd.DataFrame:
+    with instrumentation.stage('read_csv') as record:
+        df = pd.read_csv(path, index_col=0)
+        record['rows_out'] = len(df)
+    return df
+
+
+def run_category(name: str, data_dir: str = '.', out_dir: str = 'pipeline_results', threshold: float = 1.5, store: str = None, instrument: bool = False, n_topics: int = None, sentiment_method: str = None) -> dict:
+    """
+    Run load -> parse -> add_pop_unpop_col -> combine -> remove_outliers -> stats for one category.
+
+    Parameters:
+    - name: Category name, the raw videos are read from <data_dir>/<name>/top_<name>_vid.csv
+      and <data_dir>/<name>/bottom_<name>_vid.csv.
+    - data_dir: Directory holding one folder per category.
+    - out_dir: Directory the per category results are written to, under <out_dir>/<name>/.
+    - threshold: IQR multiplier passed to remove_outliers.
+    - store: Optional Parquet store directory the cleaned videos are saved to.
+    - instrument: Record the time, rows and memory of every stage to <name>_stages.csv.
+    - n_topics: Optional number of LDA title topics. The topic of every video is added
+      to the cleaned videos (and the store), the topic terms and the topic shares of
+      popular and unpopular channels are written to <name>_topics.csv and
+      <name>_topic_shares.csv. The title corpus is cached under <out_dir>/topic_cache.
+    - sentiment_method: Optional sentiment.SCORERS method. Adds titleSentiment and, when
+      the category has *_comments.csv files, commentSentiment to the cleaned videos.
+      Scores are cached under <out_dir>/sentiment_cache.
+
+    Returns a dict with the row counts before and after outlier removal, the mean of the
+    channel means for popular and unpopular channels, the test p-values and the printed log.
+    The tests of every metric are written to <name>_tests.csv.
+    """
+    if instrument:
+        instrumentation.reset()
+        instrumentation.enable(memory=True)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        # Load and parse the popular and unpopular channel videos
+        top_channels = utils.parse_cols_vectorized(
+            read_videos(f"{data_dir}/{name}/top_{name}_vid.csv"))
+        bottom_channels = utils.parse_cols_vectorized(
+            read_videos(f"{data_dir}/{name}/bottom_{name}_vid.csv"))
+
+        top_channels = utils.add_pop_unpop_col(top_channels, True)
+        bottom_channels = utils.add_pop_unpop_col(bottom_channels, False)
+        comb_vids = utils.combine_pop_unpop_df(top_channels, bottom_channels)
+
+        # Remove outliers from the dataframe
+        cleaned_dataframe = utils.remove_outliers(
+            comb_vids, 'channelTitle', 'publishingYear', 'viewCount', threshold)
+        print(comb_vids.shape, cleaned_dataframe.shape)
+
+    category_dir = os.path.join(out_dir, name)
+    os.makedirs(category_dir, exist_ok=True)
+
+    # Mean of every metric per channel, the unit the popular/unpopular tests compare
+    channel_means = cleaned_dataframe.groupby(['pop_unpop', 'channelTitle'], observed=True)[
+        CHANNEL_MEAN_COLUMNS].mean()
+    channel_means.to_csv(os.path.join(category_dir, f'{name}_channel_means.csv'))
+    average_duration_table(cleaned_dataframe).to_csv(
+        os.path.join(category_dir, f'{name}_avg_duration.csv'))
+
+    popular = channel_means.xs(1, level='pop_unpop')
+    unpopular = channel_means.xs(0, level='pop_unpop')
+
+    summary = {
+        'category': name,
+        'rows_before_outliers': len(comb_vids),
+        'rows_after_outliers': len(cleaned_dataframe),
+        'popular_channels': len(popular),
+        'unpopular_channels': len(unpopular),
+    }
+    for column in CHANNEL_MEAN_COLUMNS:
+        summary[f'popular_{column}'] = popular[column].mean()
+        summary[f'unpopular_{column}'] = unpopular[column].mean()
+
+    # All tests on the channel means, the summary keeps the ones reported in the notebook
+    tests = stat_tests.compare_pop_unpop(cleaned_dataframe)
+    tests.to_csv(os.path.join(category_dir, f'{name}_tests.csv'), index=False)
+    tests = tests.set_index('metric')
+    summary['viewCount_mannwhitney_p'] = tests.loc['viewCount', 'mannwhitney_p']
+    summary['titleLength_ttest_p'] = tests.loc['titleLength', 'ttest_p']
+
+    with open(os.path.join(category_dir, f'{name}_summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2, default=float)
+
+    if n_topics:
+        # Categories already run in parallel, so every model trains on one core
+        cleaned_dataframe, model, terms = topics.run_topics(
+            cleaned_dataframe, n_topics, os.path.join(out_dir, 'topic_cache'), workers=1)
+        topics.topic_terms(model, terms).to_csv(os.path.join(category_dir, f'{name}_topics.csv'))
+        topics.topic_shares(cleaned_dataframe).to_csv(
+            os.path.join(category_dir, f'{name}_topic_shares.csv'))
+
+    if sentiment_method is not None:
+        comment_paths = [f"{data_dir}/{name}/{group}_{name}_comments.csv" for group in ['top', 'bottom']]
+        comments = [pd.read_csv(path, index_col=0) for path in comment_paths if os.path.exists(path)]
+        cleaned_dataframe = sentiment.add_sentiment(
+            cleaned_dataframe, pd.concat(comments, ignore_index=True) if comments else None,
+            sentiment_method, os.path.join(out_dir, 'sentiment_cache'), workers=1)
+
+    if store is not None:
+        storage.save_videos(cleaned_dataframe, store, name)
+
+    if instrument:
+        instrumentation.disable()
+        instrumentation.records().to_csv(
+            os.path.join(category_dir, f'{name}_stages.csv'), index=False)
+
+    summary['log'] = log.getvalue()
+    return summary
+
+
+def run_pipeline(categories=None, data_dir: str = '.', out_dir: str = 'pipeline_results', threshold: float = 1.5, store: str = None, workers: int = None, instrument: bool = False, n_topics: int = None, sentiment_method: str = None) -> pd.DataFrame:
+    """
+    Run run_category for every category in a process pool and write the cross category
+    summary to <out_dir>/summary.csv. Returns the summary with a 'total' row.
+    """
+    categories = CATEGORIES if categories is None else list(categories)
+    workers = min(workers or os.cpu_count(), len(categories))
+
+    run = partial(run_category, data_dir=data_dir, out_dir=out_dir,
+                  threshold=threshold, store=store, instrument=instrument,
+                  n_topics=n_topics, sentiment_method=sentiment_method)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run, categories))
+
+    # Show the parsing summaries in category order instead of interleaved
+    for result in results:
+        print(f"----- {result['category']} -----")
+        print(result.pop('log'), end='')
+
+    summary = pd.DataFrame(results).set_index('category')
+    counts = ['rows_before_outliers', 'rows_after_outliers',
+              'popular_channels', 'unpopular_channels']
+    summary.loc['total', counts] = summary[counts].sum()
+    summary[counts] = summary[counts].astype(int)
+
+    os.makedirs(out_dir, exist_ok=True)
+    summary.to_csv(os.path.join(out_dir, 'summary.csv'))
+
+    for column, label in [('rows_before_outliers', 'Before Outliers'), ('rows_after_outliers', 'After Outliers')]:
+        per_category = summary[column].drop('total')
+        print(
+            f"{'+'.join(map(str, per_category))} = {summary.loc['total', column]} # {label}")
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Parse, clean and summarise the videos of every category in parallel')
+    parser.add_argument('--categories', nargs='+', default=CATEGORIES,
+                        help='Categories to run (default: all)')
+    parser.add_argument('--data-dir', default='.',
+                        help='Directory holding one folder of *_vid.csv files per category')
+    parser.add_argument('--out-dir', default='pipeline_results',
+                        help='Directory the results are written to')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='IQR multiplier used by remove_outliers')
+    parser.add_argument('--store', default=None,
+                        help='Optional Parquet store the cleaned videos are saved to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes (default: all cores)')
+    parser.add_argument('--instrument', action='store_true',
+                        help='Write the time, rows and memory of every stage per category')
+    parser.add_argument('--topics', type=int, default=None,
+                        help='Number of title topics to model per category (needs scikit-learn)')
+    parser.add_argument('--sentiment', choices=list(sentiment.SCORERS), default=None,
+                        help='Score the title and comment sentiment of every video')
+    args = parser.parse_args(argv)
+
+    run_pipeline(args.categories, args.data_dir, args.out_dir,
+                 args.threshold, args.store, args.workers, args.instrument, args.topics, args.sentiment)
+
+
+if __name__ == '__main__':
+    main()
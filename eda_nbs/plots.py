@@ -1,14 +1,103 @@
+from functools import lru_cache, partial
+
 import dash
+import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 from dash import dcc, html
 from dash.dependencies import Input, Output
 
+from callback_cache import LRUBackend, dataset_version, memoize
+from instrumentation import instrumented
+
+# Keys and statistics of the aggregate cube the Dash callbacks read from
+CUBE_KEYS = ['channelTitle', 'publishingYear',
+             'publishingMonth', 'publishingMonthName', 'pop_unpop']
+CUBE_STATS = ['sum', 'mean', 'count']
+
+POPULAR_COLOR = '#FFA500'  # Orange
+UNPOPULAR_COLOR = '#1F77B4'  # Blue
+
+# Traces with more points than this are binned (bars) or decimated (lines) before
+# they are sent to the browser
+MAX_TRACE_POINTS = 1000
+
+
+def build_channel_index(df, popular_color=POPULAR_COLOR, unpopular_color=UNPOPULAR_COLOR):
+    """
+    Channel metadata built once per dataset and shared by the plot builders:
+    channelTitle -> {'pop_unpop', 'color', 'category'}.
+    A channel is popular if any of its videos is marked popular. Without a pop_unpop
+    column every channel gets the popular (default) color, and without a category
+    column the category is None.
+    """
+    grouped = df.groupby('channelTitle', sort=False, observed=True)
+    pop_unpop = grouped['pop_unpop'].max() if 'pop_unpop' in df.columns else None
+    category = grouped['category'].first() if 'category' in df.columns else None
+
+    channel_index = {}
+    for channel in grouped.groups:
+        popularity = None if pop_unpop is None else int(pop_unpop[channel])
+        channel_index[channel] = {
+            'pop_unpop': popularity,
+            'color': unpopular_color if popularity == 0 else popular_color,
+            'category': None if category is None else category[channel],
+        }
+    return channel_index
+
+
+def build_aggregate_cube(df):
+    """
+    Group the videos once by channel, year, month and pop_unpop (when present) and keep
+    the sum, mean and count of every numeric column. Callbacks slice this small table
+    instead of re-filtering the raw video rows on every click.
+    """
+    keys = [key for key in CUBE_KEYS if key in df.columns]
+    numeric_columns = [column for column in df.select_dtypes('number').columns
+                       if column not in keys]
+    return df.groupby(keys, observed=True)[numeric_columns].agg(CUBE_STATS)
+
+
+def slice_cube(cube, channels=None, years=None, pop_unpop=None, stat='sum'):
+    """
+    Select one statistic of the cube for the given channels, years and popularity.
+    Returns a flat frame with the key columns and one row per channel, year and month.
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    if channels is not None:
+        mask &= cube.index.get_level_values('channelTitle').isin(channels)
+    if years is not None:
+        mask &= cube.index.get_level_values('publishingYear').isin(years)
+    if pop_unpop is not None:
+        mask &= cube.index.get_level_values('pop_unpop') == pop_unpop
+    return cube.loc[mask].xs(stat, axis=1, level=1).reset_index()
+
+
+def figure_memoizer(df, figure_cache=None, version=None):
+    """
+    Backend and decorator caching the figures of an app's callbacks.
+
+    Parameters:
+    - df: Frame the app is built from, hashed for the version when none is given.
+    - figure_cache: Backend shared by all sessions, an in-process LRUBackend by default.
+      Pass a callback_cache.DiskBackend to share figures between processes.
+    - version: Dataset version the cached figures belong to, e.g. the sync date.
+      Figures cached for another version are never returned.
+    """
+    if figure_cache is None:
+        figure_cache = LRUBackend()
+    if version is None:
+        version = dataset_version(df)
+    return figure_cache, memoize(figure_cache, version)
+
 
 # Bar Plots using dropdown list
-def dynamic_bar_plot(df):
+def dynamic_bar_plot(df, figure_cache=None, version=None, **dash_kwargs):
     # Create JupyterDash app
-    app = dash.Dash(__name__)
+    app = dash.Dash(__name__, **dash_kwargs)
+    # Identical selections from any session are served from the figure cache
+    app.figure_cache, cached = figure_memoizer(df, figure_cache, version)
+    cube = build_aggregate_cube(df)
 
     # Unique channels and years for dropdown options
     channels_options = [{'label': channel, 'value': channel}
@@ -44,9 +133,11 @@ def dynamic_bar_plot(df):
         [Input('channel-dropdown', 'value'),
          Input('year-dropdown', 'value')]
     )
+    @instrumented('dynamic_bar_plot.update_bar_chart')
+    @cached('dynamic_bar_plot.update_bar_chart')
     def update_bar_chart(selected_channels, selected_year):
-        filtered_df = df[(df['channelTitle'].isin(selected_channels)) &
-                         (df['publishingYear'] == selected_year)]
+        filtered_df = slice_cube(
+            cube, channels=selected_channels, years=[selected_year])
 
         traces = []
         for channel in selected_channels:
@@ -72,10 +163,12 @@ def dynamic_bar_plot(df):
         Output('line-chart-container', 'children'),
         [Input('channel-dropdown', 'value')]
     )
+    @instrumented('dynamic_bar_plot.update_line_chart')
+    @cached('dynamic_bar_plot.update_line_chart')
     def update_line_chart(selected_channels):
         traces = []
         for channel in selected_channels:
-            channel_data = df[df['channelTitle'] == channel].groupby(
+            channel_data = slice_cube(cube, channels=[channel]).groupby(
                 'publishingYear')['viewCount'].sum().reset_index()
             trace = go.Scatter(
                 x=channel_data['publishingYear'],
@@ -103,8 +196,11 @@ def dynamic_bar_plot(df):
 # Plot that has toggle buttons of channelLists
 
 
-def toggle_dynamic_bar_plot(df):
-    app = dash.Dash(__name__)
+def toggle_dynamic_bar_plot(df, figure_cache=None, version=None, **dash_kwargs):
+    app = dash.Dash(__name__, **dash_kwargs)
+    # Identical selections from any session are served from the figure cache
+    app.figure_cache, cached = figure_memoizer(df, figure_cache, version)
+    cube = build_aggregate_cube(df)
 
     # Unique channels and years for dropdown options
     channels_options = [{'label': channel, 'value': channel}
@@ -140,9 +236,11 @@ def toggle_dynamic_bar_plot(df):
         [Input('channel-toggle', 'value'),
          Input('year-dropdown', 'value')]
     )
+    @instrumented('toggle_dynamic_bar_plot.update_bar_chart')
+    @cached('toggle_dynamic_bar_plot.update_bar_chart')
     def update_bar_chart(selected_channels, selected_year):
-        filtered_df = df[(df['channelTitle'].isin(selected_channels)) &
-                         (df['publishingYear'] == selected_year)]
+        filtered_df = slice_cube(
+            cube, channels=selected_channels, years=[selected_year])
 
         traces = []
         for channel in selected_channels:
@@ -168,10 +266,12 @@ def toggle_dynamic_bar_plot(df):
         Output('line-chart-container', 'children'),
         [Input('channel-toggle', 'value')]
     )
+    @instrumented('toggle_dynamic_bar_plot.update_line_chart')
+    @cached('toggle_dynamic_bar_plot.update_line_chart')
     def update_line_chart(selected_channels):
         traces = []
         for channel in selected_channels:
-            channel_data = df[df['channelTitle'] == channel].groupby(
+            channel_data = slice_cube(cube, channels=[channel]).groupby(
                 'publishingYear')['viewCount'].sum().reset_index()
             trace = go.Scatter(
                 x=channel_data['publishingYear'],
@@ -197,6 +297,64 @@ def toggle_dynamic_bar_plot(df):
     return app
 
 
+def bin_monthly(channel_data, y_column):
+    """
+    Sum y_column per publishing year and month, the same bins as the aggregate cube,
+    so a trace of raw video rows becomes at most one bar per month of every year
+    """
+    keys = [key for key in ['publishingYear', 'publishingMonth', 'publishingMonthName']
+            if key in channel_data.columns]
+    return channel_data.groupby(keys, sort=True, observed=True)[y_column].sum().reset_index()
+
+
+def lttb(x, y, n_out):
+    """
+    Indices of the n_out points Largest-Triangle-Three-Buckets keeps from the series
+    (x sorted ascending). The first and last points are always kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    edges = np.append(edges, n)
+
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        # Keep the point forming the largest triangle with the previous kept point
+        # and the average of the next bucket
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        indices[i + 1] = previous
+
+    return indices
+
+
+def decimate_line(x, y, max_points=MAX_TRACE_POINTS):
+    """
+    x and y reduced to at most max_points with lttb, unchanged when already short enough
+    """
+    if max_points is None or len(x) <= max_points:
+        return x, y
+    x, y = np.asarray(x), np.asarray(y)
+    order = np.argsort(x, kind='stable')
+    # Kept points stay in their original order
+    indices = np.sort(order[lttb(x[order], y[order], max_points)])
+    return x[indices], y[indices]
+
+
 def create_bar_plot(filtered_df, title):
     traces = []
     for channel in filtered_df['channelTitle'].unique():
@@ -218,10 +376,13 @@ def create_bar_plot(filtered_df, title):
     return {'data': traces, 'layout': layout}
 
 
-def create_bar_plot(filtered_df, title, y_column):
+def create_bar_plot(filtered_df, title, y_column, max_points=MAX_TRACE_POINTS):
     traces = []
     for channel in filtered_df['channelTitle'].unique():
         channel_data = filtered_df[filtered_df['channelTitle'] == channel]
+        # Raw video rows are pre-binned into monthly totals above the point threshold
+        if max_points is not None and len(channel_data) > max_points:
+            channel_data = bin_monthly(channel_data, y_column)
         trace = go.Bar(
             x=channel_data['publishingMonthName'],
             y=channel_data[y_column],  # Use the selected numerical column
@@ -239,23 +400,26 @@ def create_bar_plot(filtered_df, title, y_column):
     return {'data': traces, 'layout': layout}
 
 
-def create_line_plot(filtered_df, title, y_column):
+def create_line_plot(filtered_df, title, y_column, channel_index=None, max_points=MAX_TRACE_POINTS):
+    if channel_index is None:
+        channel_index = build_channel_index(filtered_df)
+
     traces = []
     for channel in filtered_df['channelTitle'].unique():
         channel_data = filtered_df[filtered_df['channelTitle'] == channel]
 
         # Assign colors based on popularity
-        color = '#FFA500'  # Default color (Orange)
-        if channel_data['pop_unpop'].iloc[0] == 0:
-            color = '#1F77B4'  # Blue for unpopular channels
+        color = channel_index[channel]['color']
 
         # Aggregate data by summing up the selected numerical column for each month
         aggregated_data = channel_data.groupby(
             'publishingYear').agg({y_column: 'sum'}).reset_index()
+        x, y = decimate_line(
+            aggregated_data['publishingYear'], aggregated_data[y_column], max_points)
 
         trace = go.Scatter(
-            x=aggregated_data['publishingYear'],
-            y=aggregated_data[y_column],  # Use the selected numerical column
+            x=x,
+            y=y,  # Use the selected numerical column
             mode='lines+markers',
             name=channel,
             line=dict(color=color),
@@ -272,16 +436,20 @@ def create_line_plot(filtered_df, title, y_column):
     return {'data': traces, 'layout': layout}
 
 
-def dynamic_view_plots(df):
+def dynamic_view_plots(df, figure_cache=None, version=None, **dash_kwargs):
     # Create JupyterDash app with suppress_callback_exceptions=True
-    app = dash.Dash(__name__, suppress_callback_exceptions=True)
+    app = dash.Dash(__name__, suppress_callback_exceptions=True, **dash_kwargs)
+    # Identical selections from any session are served from the figure cache
+    app.figure_cache, cached = figure_memoizer(df, figure_cache, version)
+    cube = build_aggregate_cube(df)
+    channel_index = build_channel_index(df)
     pop_titles = [{'label': title, 'value': title}
                   for title in df[df['pop_unpop'] == 1]['channelTitle'].unique()]
     unpop_titles = [{'label': title, 'value': title}
                     for title in df[df['pop_unpop'] == 0]['channelTitle'].unique()]
 
     numerical_columns = [{'label': column, 'value': column}
-                         for column in df.select_dtypes('number').columns]
+                         for column in cube.columns.unique(level=0)]
 
     # Layout of the app
     app.layout = html.Div([
@@ -358,14 +526,16 @@ def dynamic_view_plots(df):
          Input('year-checklist-bar-plots', 'value'),
          Input('numerical-column-dropdown', 'value')]
     )
+    @instrumented('dynamic_view_plots.update_bar_plots')
+    @cached('dynamic_view_plots.update_bar_plots')
     def update_bar_plots(selected_channels_popular, selected_channels_unpopular, selected_years, selected_column):
-        filtered_df_popular = df[(df['pop_unpop'] == 1) & (df['channelTitle'].isin(
-            selected_channels_popular)) & (df['publishingYear'].isin(selected_years))]
+        filtered_df_popular = slice_cube(
+            cube, channels=selected_channels_popular, years=selected_years, pop_unpop=1)
         bar_plot_a = create_bar_plot(
             filtered_df_popular, title=f'Monthly {selected_column.capitalize()} for Popular Channels', y_column=selected_column)
 
-        filtered_df_unpopular = df[(df['pop_unpop'] == 0) & (df['channelTitle'].isin(
-            selected_channels_unpopular)) & (df['publishingYear'].isin(selected_years))]
+        filtered_df_unpopular = slice_cube(
+            cube, channels=selected_channels_unpopular, years=selected_years, pop_unpop=0)
         bar_plot_b = create_bar_plot(
             filtered_df_unpopular, title=f'Monthly {selected_column.capitalize()} for Unpopular Channels', y_column=selected_column)
 
@@ -381,21 +551,23 @@ def dynamic_view_plots(df):
          Input('year-checklist-line-plots', 'value'),
          Input('numerical-column-dropdown', 'value')]
     )
+    @instrumented('dynamic_view_plots.update_line_plots')
+    @cached('dynamic_view_plots.update_line_plots')
     def update_line_plots(selected_channels_popular, selected_channels_unpopular, selected_years, selected_column):
-        filtered_df_popular = df[(df['pop_unpop'] == 1) & (df['channelTitle'].isin(
-            selected_channels_popular)) & (df['publishingYear'].isin(selected_years))]
+        filtered_df_popular = slice_cube(
+            cube, channels=selected_channels_popular, years=selected_years, pop_unpop=1)
         line_plot_a = create_line_plot(
-            filtered_df_popular, title=f'Yearly Trend for Popular Channels - {selected_column.capitalize()}', y_column=selected_column)
+            filtered_df_popular, title=f'Yearly Trend for Popular Channels - {selected_column.capitalize()}', y_column=selected_column, channel_index=channel_index)
 
-        filtered_df_unpopular = df[(df['pop_unpop'] == 0) & (df['channelTitle'].isin(
-            selected_channels_unpopular)) & (df['publishingYear'].isin(selected_years))]
+        filtered_df_unpopular = slice_cube(
+            cube, channels=selected_channels_unpopular, years=selected_years, pop_unpop=0)
         line_plot_b = create_line_plot(
-            filtered_df_unpopular, title=f'Yearly Trend for Unpopular Channels - {selected_column.capitalize()}', y_column=selected_column)
+            filtered_df_unpopular, title=f'Yearly Trend for Unpopular Channels - {selected_column.capitalize()}', y_column=selected_column, channel_index=channel_index)
 
-        all_channels = df[(df['channelTitle'].isin(selected_channels_popular)) | (
-            df['channelTitle'].isin(selected_channels_unpopular))]
+        all_channels = slice_cube(
+            cube, channels=selected_channels_popular + selected_channels_unpopular)
         line_plot_c = create_line_plot(
-            all_channels, title=f'Yearly Trend for All Selected Channels - {selected_column.capitalize()}', y_column=selected_column)
+            all_channels, title=f'Yearly Trend for All Selected Channels - {selected_column.capitalize()}', y_column=selected_column, channel_index=channel_index)
 
         return line_plot_a, line_plot_b, line_plot_c
 
@@ -403,39 +575,57 @@ def dynamic_view_plots(df):
 
 
 
-def calculate_percentiles(df, channels, percentiles, year_column='publishingYear', views_column='viewCount'):
-    percentiles_data = {percentile: {} for percentile in percentiles}
+def calculate_channel_percentiles(df, channel, percentiles, year_column='publishingYear', views_column='viewCount'):
+    """
+    Percentiles of one channel for every year it published in, computed with one grouped
+    quantile call. Returns {percentile: {'x': years, 'y': values}}.
+    """
+    channel_df = df[df['channelTitle'] == channel]
+    values = channel_df.groupby(year_column, sort=False)[views_column].quantile(
+        [float(percentile) for percentile in percentiles])
+
+    channel_data = {}
+    for percentile in percentiles:
+        column = values.xs(float(percentile), level=-1)
+        channel_data[percentile] = {'x': column.index.tolist(),
+                                    'y': column.tolist()}
+    return channel_data
 
+
+def calculate_percentiles(df, channels, percentiles, year_column='publishingYear', views_column='viewCount', channel_percentiles=None):
+    """
+    Percentiles per channel and year as {percentile: {channel: {'x': years, 'y': values}}}.
+    channel_percentiles can be a memoized function with the signature
+    (channel, percentiles, year_column, views_column) to reuse earlier results.
+    """
+    if channel_percentiles is None:
+        channel_percentiles = partial(calculate_channel_percentiles, df)
+
+    percentiles_data = {percentile: {} for percentile in percentiles}
     for channel in channels:
-        channel_df = df[df['channelTitle'] == channel]
+        channel_data = channel_percentiles(
+            channel, tuple(percentiles), year_column, views_column)
         for percentile in percentiles:
-            if percentile not in percentiles_data:
-                percentiles_data[percentile] = {}
-            if channel not in percentiles_data[percentile]:
-                percentiles_data[percentile][channel] = {'x': [], 'y': []}
-
-            for year in channel_df[year_column].unique():
-                year_df = channel_df[channel_df[year_column] == year]
-                if not year_df.empty:
-                    value = year_df[views_column].quantile(float(percentile))
-                    percentiles_data[percentile][channel]['x'].append(year)
-                    percentiles_data[percentile][channel]['y'].append(value)
+            percentiles_data[percentile][channel] = channel_data[percentile]
 
     return percentiles_data
 
 
-def plot_percentiles(df, channels, percentiles_data, percentile, popular_color='orange', unpopular_color='blue'):
+def plot_percentiles(df, channels, percentiles_data, percentile, popular_color='orange', unpopular_color='blue', channel_index=None, max_points=MAX_TRACE_POINTS):
+    if channel_index is None:
+        channel_index = build_channel_index(df)
+
     fig = go.Figure()
 
     for channel in channels:
         if channel in percentiles_data[percentile]:
             data = percentiles_data[percentile][channel]
-            color = popular_color if df[(df['channelTitle'] == channel) & (
-                df['pop_unpop'] == 1)].any().any() else unpopular_color
+            color = popular_color if channel_index[channel]['pop_unpop'] == 1 else unpopular_color
+            x, y = decimate_line(data['x'], data['y'], max_points)
 
             trace = go.Scatter(
-                x=data['x'],
-                y=data['y'],
+                x=x,
+                y=y,
                 mode='lines+markers',
                 name=f'{channel} - {percentile}',
                 line=dict(color=color),
@@ -454,8 +644,19 @@ def plot_percentiles(df, channels, percentiles_data, percentile, popular_color='
     return fig
 
 
-def percentiles_plot(df, percentiles):
-    app = dash.Dash(__name__)
+def percentiles_plot(df, percentiles, cache_size=128, figure_cache=None, version=None, **dash_kwargs):
+    app = dash.Dash(__name__, **dash_kwargs)
+
+    # Per-channel percentiles are memoized so a toggle only computes the newly added
+    # channel, hit/miss counters are available through app.percentiles_cache.cache_info()
+    @lru_cache(maxsize=cache_size)
+    def cached_channel_percentiles(channel, percentiles, year_column, views_column):
+        return calculate_channel_percentiles(df, channel, percentiles, year_column, views_column)
+
+    app.percentiles_cache = cached_channel_percentiles
+    # Identical selections from any session are served from the figure cache
+    app.figure_cache, cached = figure_memoizer(df, figure_cache, version)
+    channel_index = build_channel_index(df)
 
     app.layout = html.Div([
         html.H1("Interactive Percentiles Plot"),
@@ -488,14 +689,17 @@ def percentiles_plot(df, percentiles):
         [Input('channel-checklist-popular', 'value'),
          Input('channel-checklist-unpopular', 'value')]
     )
+    @instrumented('percentiles_plot.update_percentiles_plot')
+    # The key includes the percentiles, apps with other percentiles can share a backend
+    @cached(f'percentiles_plot.update_percentiles_plot{tuple(percentiles)}')
     def update_percentiles_plot(selected_channels_popular, selected_channels_unpopular):
         selected_channels = selected_channels_popular + selected_channels_unpopular
         percentiles_data = calculate_percentiles(
-            df, selected_channels, percentiles)
+            df, selected_channels, percentiles, channel_percentiles=cached_channel_percentiles)
 
         # Generate figures for each percentile
         figures = [plot_percentiles(
-            df, selected_channels, percentiles_data, percentile) for percentile in percentiles]
+            df, selected_channels, percentiles_data, percentile, channel_index=channel_index) for percentile in percentiles]
         return figures
 
     return app
\ No newline at end of file
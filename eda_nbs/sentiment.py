@@ -0,0 +1,186 @@
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+import fileio
+import text
+from instrumentation import instrumented
+
+# Texts scored per task sent to a worker process
+BATCH_SIZE = 2_000
+
+
+def vader_scorer():
+    """
+    VADER compound score in [-1, 1], like title_analysis.ipynb
+    (needs nltk and nltk.download('vader_lexicon'))
+    """
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+    analyzer = SentimentIntensityAnalyzer()
+    return lambda value: analyzer.polarity_scores(value)['compound']
+
+
+def textblob_scorer():
+    """
+    TextBlob polarity in [-1, 1] (needs textblob)
+    """
+    from textblob import TextBlob
+
+    return lambda value: TextBlob(value).sentiment.polarity
+
+
+# Scoring methods by name, every factory returns a function scoring one text
+SCORERS = {'vader': vader_scorer, 'textblob': textblob_scorer}
+
+
+@lru_cache()
+def scorer(method: str):
+    """
+    Scoring function of a method, built once per process (VADER loads its lexicon)
+    """
+    return SCORERS[method]()
+
+
+def score_batch(texts, method: str) -> list:
+    """
+    Scores of a list of texts, run in the worker processes
+    """
+    score = scorer(method)
+    return [score(value) for value in texts]
+
+
+def text_hashes(texts) -> np.ndarray:
+    """
+    Stable 64 bit hash of every text, the key of the score cache
+    """
+    return pd.util.hash_array(np.asarray(texts, dtype=object))
+
+
+class ScoreCache:
+    """
+    Scores of already scored texts by text hash, stored as Parquet files under
+    <directory>/<method>/ so re-runs only score new or changed texts. Every save adds
+    one file with the new scores, existing files are never rewritten.
+    """
+
+    def __init__(self, directory: str = 'sentiment_cache', method: str = 'vader'):
+        self.directory = os.path.join(directory, method)
+        os.makedirs(self.directory, exist_ok=True)
+        # Hidden files are parts still being written
+        parts = [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                 if name.endswith('.parquet') and not name.startswith('.')]
+        if parts:
+            scores = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+            self.scores = scores.drop_duplicates('hash').set_index('hash')['score']
+        else:
+            self.scores = pd.Series([], index=pd.Index([], dtype='uint64', name='hash'),
+                                    dtype='float64', name='score')
+
+    def __len__(self):
+        return len(self.scores)
+
+    def get(self, hashes) -> np.ndarray:
+        """
+        Score of every hash, NaN for hashes not in the cache
+        """
+        return self.scores.reindex(hashes).to_numpy()
+
+    def add(self, hashes, scores) -> None:
+        new = pd.DataFrame({'hash': np.asarray(hashes, dtype='uint64'),
+                            'score': np.asarray(scores, dtype='float64')})
+        if new.empty:
+            return
+        self.scores = pd.concat([self.scores, new.set_index('hash')['score']])
+
+        path = os.path.join(self.directory, f'part-{uuid.uuid4().hex}.parquet')
+        with fileio.atomic_path(path) as tmp_path:
+            new.to_parquet(tmp_path, index=False)
+
+
+@instrumented()
+def score_texts(texts, method: str = 'vader', cache_dir: str = 'sentiment_cache', workers: int = None, batch_size: int = BATCH_SIZE) -> np.ndarray:
+    """
+    Sentiment score of every text.
+
+    Parameters:
+    - texts: Series or list of strings, missing values get NaN.
+    - method: Name of a SCORERS method, 'vader' or 'textblob'.
+    - cache_dir: Directory of the persistent ScoreCache, None to score everything.
+    - workers: Number of processes scoring the batches (default: all cores).
+    - batch_size: Texts per task.
+
+    Every distinct text is scored once. Texts already in the cache are not scored again,
+    the rest are scored in batches across a process pool and added to the cache.
+    """
+    texts = pd.Series(texts, dtype=object)
+    missing = texts.isna().to_numpy()
+    values = texts.fillna('').astype(str).to_numpy(dtype=object)
+
+    # Distinct texts, and the ones without a cached score
+    hashes = text_hashes(values)
+    unique_hashes, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    cache = ScoreCache(cache_dir, method) if cache_dir is not None else None
+    unique_scores = cache.get(unique_hashes) if cache is not None else np.full(len(unique_hashes), np.nan)
+    todo = np.flatnonzero(np.isnan(unique_scores))
+
+    if len(todo):
+        todo_texts = values[first[todo]].tolist()
+        batches = [todo_texts[start:start + batch_size] for start in range(0, len(todo_texts), batch_size)]
+        workers = min(workers or os.cpu_count(), len(batches))
+        if workers == 1:
+            results = list(map(score_batch, batches, repeat(method)))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(score_batch, batches, repeat(method)))
+        unique_scores[todo] = [score for batch in results for score in batch]
+        if cache is not None:
+            cache.add(unique_hashes[todo], unique_scores[todo])
+
+    scores = unique_scores[inverse]
+    scores[missing] = np.nan
+    return scores
+
+
+def sentiment_category(scores) -> np.ndarray:
+    """
+    'positive', 'negative' or 'neutral' for every score, like title_analysis.ipynb
+    """
+    scores = np.asarray(scores, dtype='float64')
+    return np.select([scores > 0, scores < 0], ['positive', 'negative'], 'neutral')
+
+
+def comment_sentiment(comments: pd.DataFrame, method: str = 'vader', cache_dir: str = 'sentiment_cache', workers: int = None) -> pd.Series:
+    """
+    Mean sentiment of the comments of every video of a *_comments.csv frame, indexed by
+    video_id
+    """
+    exploded = text.parse_comments(comments['comments'])
+    scores = pd.Series(score_texts(exploded, method, cache_dir, workers),
+                       index=comments.loc[exploded.index, 'video_id'].to_numpy())
+    return scores.groupby(level=0).mean().rename_axis('video_id')
+
+
+@instrumented()
+def add_sentiment(df: pd.DataFrame, comments: pd.DataFrame = None, method: str = 'vader', cache_dir: str = 'sentiment_cache', workers: int = None) -> pd.DataFrame:
+    """
+    Copy of a video frame with the title sentiment in 'titleSentiment' and, given the
+    comments frame of the same videos, the mean comment sentiment in 'commentSentiment'.
+    The columns are placed right after likeRatio and commentRatio when present.
+    """
+    columns = {'titleSentiment': score_texts(df['title'], method, cache_dir, workers)}
+    if comments is not None:
+        columns['commentSentiment'] = df['video_id'].map(
+            comment_sentiment(comments, method, cache_dir, workers)).to_numpy()
+
+    df = df.drop(columns=[column for column in columns if column in df.columns])
+    position = max([df.columns.get_loc(column) + 1 for column in ['likeRatio', 'commentRatio']
+                    if column in df.columns], default=len(df.columns))
+    for offset, (column, values) in enumerate(columns.items()):
+        df.insert(position + offset, column, values)
+    return df
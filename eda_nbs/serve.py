@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
+import numpy as np
+import pyarrow as pa
+
+import fileio
+import plots
+import storage
+from callback_cache import DiskBackend
+
+# Columns the dashboards read, everything else is left out of the served file
+SERVE_COLUMNS = ['channelTitle', 'pop_unpop', 'publishingYear', 'publishingMonth',
+                 'publishingMonthName', 'viewCount', 'likeCount', 'commentCount',
+                 'durationSecs', 'likeRatio', 'commentRatio', 'titleLength', 'tagsCount']
+PERCENTILES = ['.25', '.5', '.75', '.9', '.95', '.99']
+
+# Dash apps served by create_server, by url prefix
+APPS = ['views', 'percentiles', 'bars']
+
+
+def export_dataset(df, path):
+    """
+    Write the columns the dashboards use to an uncompressed Arrow IPC file that every
+    server worker memory-maps instead of holding its own copy of the frame
+    """
+    columns = [column for column in SERVE_COLUMNS if column in df.columns]
+    table = pa.Table.from_pandas(df[columns], preserve_index=False)
+
+    # Strings are dictionary encoded so they load as categoricals instead of one
+    # Python string per row
+    for name in ['channelTitle', 'publishingMonthName']:
+        index = table.schema.get_field_index(name)
+        if index != -1 and not pa.types.is_dictionary(table.schema.field(index).type):
+            table = table.set_column(index, name, table.column(name).dictionary_encode())
+
+    # One record batch, so every column maps to one contiguous buffer
+    table = table.combine_chunks()
+    with fileio.atomic_path(path) as tmp_path, pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def load_shared_dataset(path):
+    """
+    Memory-map a file written by export_dataset. Numeric columns without nulls point
+    into the mapped file (read-only, shared through the page cache by all workers)
+    instead of being copied.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def dataset_file_version(path):
+    """
+    Version of an exported dataset that every worker agrees on without hashing it
+    """
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def create_server(dataset_path, figure_cache_dir=None, percentiles=PERCENTILES):
+    """
+    Flask server with the dashboards mounted under /views/, /percentiles/ and /bars/.
+
+    Parameters:
+    - dataset_path: Arrow file written by export_dataset.
+    - figure_cache_dir: Optional directory of a DiskBackend shared by all workers,
+      otherwise every worker keeps its own in-process figure cache.
+    - percentiles: Percentiles shown by the percentiles app.
+    """
+    df = load_shared_dataset(dataset_path)
+    version = dataset_file_version(dataset_path)
+    server = flask.Flask(__name__)
+
+    def figure_cache():
+        return DiskBackend(figure_cache_dir) if figure_cache_dir is not None else None
+
+    plots.dynamic_view_plots(df, figure_cache=figure_cache(), version=version,
+                             server=server, url_base_pathname='/views/')
+    plots.percentiles_plot(df, percentiles, figure_cache=figure_cache(), version=version,
+                           server=server, url_base_pathname='/percentiles/')
+    plots.dynamic_bar_plot(df, figure_cache=figure_cache(), version=version,
+                           server=server, url_base_pathname='/bars/')
+
+    @server.route('/')
+    def index():
+        links = ''.join(f'<li><a href="/{name}/">{name}</a></li>' for name in APPS)
+        return f'<h1>Dashboards</h1><ul>{links}</ul>'
+
+    return server
+
+
+def wsgi_app():
+    """
+    WSGI entry point configured through environment variables, e.g.
+
+        SMR_YT_DATASET=tech.arrow SMR_YT_FIGURE_CACHE=figure_cache \\
+            gunicorn --workers 4 --preload 'serve:wsgi_app()'
+
+    With --preload the apps are built once before the workers are forked.
+    """
+    return create_server(os.environ['SMR_YT_DATASET'], os.environ.get('SMR_YT_FIGURE_CACHE'))
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def layout_components(layout):
+    """
+    {id: (component type, props)} of every component with an id in a Dash layout
+    """
+    components = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            props = node['props']
+            if 'id' in props:
+                components[props['id']] = (node.get('type'), props)
+            stack.append(props.get('children'))
+    return components
+
+
+def random_value(component, rng):
+    """
+    Random selection for a checklist or dropdown, up to 8 options for multi selections
+    """
+    component_type, props = component
+    options = [option['value'] if isinstance(option, dict) else option
+               for option in props.get('options') or []]
+    if not options:
+        return props.get('value')
+    if component_type == 'Checklist' or props.get('multi'):
+        return rng.sample(options, rng.randint(1, min(len(options), 8)))
+    return rng.choice(options)
+
+
+def callback_payloads(base_url, rng, distinct=20):
+    """
+    Request bodies for _dash-update-component with random input selections, distinct
+    per callback (a small number lets the figure cache serve repeat selections)
+    """
+    dependencies = get_json(base_url + '_dash-dependencies')
+    components = layout_components(get_json(base_url + '_dash-layout'))
+
+    payloads = []
+    for dependency in dependencies:
+        output = dependency['output']
+        if output.startswith('..'):
+            outputs = [dict(zip(['id', 'property'], part.rsplit('.', 1)))
+                       for part in output.strip('.').split('...')]
+        else:
+            outputs = dict(zip(['id', 'property'], output.rsplit('.', 1)))
+
+        for _ in range(distinct):
+            inputs = [{'id': item['id'], 'property': item['property'],
+                       'value': random_value(components[item['id']], rng)}
+                      for item in dependency['inputs']]
+            payloads.append(json.dumps({
+                'output': output, 'outputs': outputs, 'inputs': inputs,
+                'changedPropIds': [f"{item['id']}.{item['property']}" for item in inputs],
+            }).encode())
+    return payloads
+
+
+def load_test(base_url, requests=200, concurrency=8, distinct=20, seed=0):
+    """
+    Send callback requests to one app from concurrency threads and return the throughput,
+    latency percentiles, errors and mean response size.
+
+    Parameters:
+    - base_url: App url, e.g. 'http://127.0.0.1:8050/views/'.
+    - requests: Total number of callback requests.
+    - concurrency: Number of requests in flight at a time.
+    - distinct: Number of distinct selections per callback.
+    - seed: Seed of the random selections and request order.
+    """
+    rng = random.Random(seed)
+    payloads = callback_payloads(base_url, rng, distinct)
+    bodies = [rng.choice(payloads) for _ in range(requests)]
+    url = base_url + '_dash-update-component'
+
+    def send(body):
+        request = urllib.request.Request(url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                size = len(response.read())
+            ok = response.status == 200
+        except OSError:
+            size, ok = 0, False
+        return time.perf_counter() - start, size, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, bodies))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _, _ in results]) * 1000
+    return {
+        'requests': requests,
+        'errors': sum(not ok for _, _, ok in results),
+        'seconds': elapsed,
+        'requests_per_sec': requests / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_response_kb': float(np.mean([size for _, size, _ in results])) / 1e3,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the plots.py dashboards')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser(
+        'export', help='Export videos from the Parquet store to a served Arrow file')
+    export.add_argument('--store', required=True, help='Parquet store written by storage.save_videos')
+    export.add_argument('--categories', nargs='+', default=None)
+    export.add_argument('--out', default='dashboard.arrow')
+
+    run = commands.add_parser(
+        'run', help='Serve locally from one process with a thread per request, '
+                    'run wsgi_app under gunicorn for several worker processes')
+    run.add_argument('--dataset', default='dashboard.arrow')
+    run.add_argument('--figure-cache', default=None,
+                     help='Directory of a figure cache kept across restarts')
+    run.add_argument('--host', default='127.0.0.1')
+    run.add_argument('--port', type=int, default=8050)
+
+    load = commands.add_parser('loadgen', help='Measure the callback throughput of a running app')
+    load.add_argument('--url', default='http://127.0.0.1:8050/views/')
+    load.add_argument('--requests', type=int, default=200)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--distinct', type=int, default=20)
+    load.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args(argv)
+    if args.command == 'export':
+        export_dataset(storage.load_videos(args.store, categories=args.categories), args.out)
+    elif args.command == 'run':
+        from werkzeug.serving import run_simple
+
+        # Development server: the caches live as long as this process, for persistent
+        # worker processes serve wsgi_app with gunicorn (see its docstring)
+        server = create_server(args.dataset, args.figure_cache)
+        run_simple(args.host, args.port, server, threaded=True)
+    else:
+        print(json.dumps(load_test(args.url, args.requests, args.concurrency,
+                                   args.distinct, args.seed), indent=2))
+
+
+if __name__ == '__main__':
+    main()
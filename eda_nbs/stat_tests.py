@@ -0,0 +1,275 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from scipy.stats import mannwhitneyu, norm, t as t_distribution
+
+import storage
+from instrumentation import instrumented
+
+# Metrics compared between popular and unpopular channels
+METRICS = ['viewCount', 'likeRatio', 'commentRatio',
+           'durationSecs', 'tagsCount', 'titleLength']
+
+# Columns identifying one test, every other results column is computed per cell
+CELL_COLUMNS = ['category', 'years', 'metric']
+
+# Largest number of resampled values held in memory at once per cell
+RESAMPLE_BATCH_VALUES = 2_000_000
+
+
+def year_windows(years, size: int, step: int = None) -> list:
+    """
+    Sliding (first_year, last_year) windows of size years over the given years,
+    e.g. year_windows(range(2015, 2024), 3, 3) -> [(2015, 2017), (2018, 2020), (2021, 2023)]
+    """
+    years = sorted(set(int(year) for year in years))
+    step = step or 1
+    last_start = max(years[-1] - size + 1, years[0])
+    return [(start, start + size - 1) for start in range(years[0], last_start + 1, step)]
+
+
+def stack_windows(df: pd.DataFrame, windows=None) -> pd.DataFrame:
+    """
+    Rows of every year window, with the window as a 'years' label ('2019-2021', or 'all'
+    without windows). Windows can overlap, a video then appears once per window.
+    """
+    if windows is None:
+        return df.assign(years='all')
+
+    frames = []
+    for first_year, last_year in windows:
+        in_window = df['publishingYear'].between(first_year, last_year)
+        frames.append(df[in_window].assign(years=f'{first_year}-{last_year}'))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_samples(df: pd.DataFrame, metrics=METRICS, windows=None, unit: str = 'channel', category_column: str = 'category') -> pd.DataFrame:
+    """
+    Long frame of the values every test compares, one row per (category, years, metric,
+    pop_unpop, sample) with the sample value in 'value'. Missing values are dropped.
+
+    Parameters:
+    - df: Cleaned combined frame, e.g. from remove_outliers or storage.load_videos.
+    - metrics: Numeric columns that are compared.
+    - windows: Optional list of (first_year, last_year) windows, all years by default.
+    - unit: 'channel' compares the per channel means (like Statistical_Analysis.ipynb),
+      'video' compares the videos themselves.
+    - category_column: Column holding the category, a frame without it is one category 'all'.
+    """
+    if category_column in df.columns:
+        df = df[[category_column, 'pop_unpop', 'channelTitle', 'publishingYear', *metrics]]
+        df = df.rename(columns={category_column: 'category'})
+    else:
+        df = df[['pop_unpop', 'channelTitle', 'publishingYear', *metrics]].assign(category='all')
+    df = stack_windows(df, windows)
+
+    if unit == 'channel':
+        df = df.groupby(['category', 'years', 'pop_unpop', 'channelTitle'], observed=True)[
+            metrics].mean().reset_index()
+    elif unit != 'video':
+        raise ValueError(f"unit must be 'channel' or 'video', not {unit!r}")
+
+    samples = df.melt(id_vars=['category', 'years', 'pop_unpop'], value_vars=metrics,
+                      var_name='metric', value_name='value')
+    samples['category'] = samples['category'].astype(str)
+    samples['value'] = samples['value'].astype('float64')
+    return samples.dropna(subset=['value'])
+
+
+def batched_tests(samples: pd.DataFrame) -> pd.DataFrame:
+    """
+    Welch t-test and two-sided Mann-Whitney U test of popular against unpopular values
+    for every cell of test_samples at once.
+
+    The statistics come from one grouped pass over all cells instead of one scipy call
+    per cell and match scipy's ttest_ind(equal_var=False) and mannwhitneyu defaults.
+    Cells scipy would test exactly (either group <= 8 values, no ties) fall back
+    to mannwhitneyu.
+    """
+    popular = samples['pop_unpop'].to_numpy() == 1
+
+    # Count, mean and variance of both groups
+    moments = samples.groupby([*CELL_COLUMNS, popular])['value'].agg(['count', 'mean', 'var'])
+    moments = moments.unstack(level=-1).reindex(columns=[True, False], level=1)
+    n1, n2 = moments[('count', True)].fillna(0), moments[('count', False)].fillna(0)
+    mean1, mean2 = moments[('mean', True)], moments[('mean', False)]
+    var1, var2 = moments[('var', True)] / n1, moments[('var', False)] / n2
+
+    results = pd.DataFrame({'n_popular': n1.astype('int64'), 'n_unpopular': n2.astype('int64'),
+                            'mean_popular': mean1, 'mean_unpopular': mean2,
+                            'mean_diff': mean1 - mean2})
+
+    # Welch t-test, Welch-Satterthwaite degrees of freedom
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['t_statistic'] = (mean1 - mean2) / np.sqrt(var1 + var2)
+        dof = (var1 + var2) ** 2 / (var1 ** 2 / (n1 - 1) + var2 ** 2 / (n2 - 1))
+    results['ttest_p'] = 2 * t_distribution.sf(np.abs(results['t_statistic']), dof)
+
+    # Mann-Whitney U from the ranks within every cell, with the tie correction
+    cells = samples.groupby(CELL_COLUMNS, sort=False)['value']
+    ranks = cells.rank().to_numpy()
+    rank_sums = pd.Series(np.where(popular, ranks, 0.0)).groupby(
+        [samples[column].to_numpy() for column in CELL_COLUMNS]).sum()
+    rank_sums.index.names = CELL_COLUMNS
+    ties = samples.groupby([*CELL_COLUMNS, 'value']).size()
+    tie_terms = (ties ** 3 - ties).groupby(level=CELL_COLUMNS).sum()
+    has_ties = (ties > 1).groupby(level=CELL_COLUMNS).any()
+
+    u1 = rank_sums.reindex(results.index) - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_terms.reindex(results.index) / (n * (n - 1))))
+        z = (np.maximum(u1, n1 * n2 - u1) - n1 * n2 / 2 - 0.5) / sigma
+    results['u_statistic'] = u1
+    results['mannwhitney_p'] = np.clip(2 * norm.sf(z), 0, 1)
+
+    exact = (n1 > 0) & (n2 > 0) & ((n1 <= 8) | (n2 <= 8)) & ~has_ties.reindex(results.index)
+    if exact.any():
+        grouped = samples.groupby([*CELL_COLUMNS, popular])['value']
+        for cell in results.index[exact]:
+            results.loc[cell, 'mannwhitney_p'] = mannwhitneyu(
+                grouped.get_group((*cell, True)), grouped.get_group((*cell, False))).pvalue
+
+    # Tests need values in both groups
+    empty = (n1 == 0) | (n2 == 0)
+    results.loc[empty, ['t_statistic', 'ttest_p', 'u_statistic', 'mannwhitney_p']] = np.nan
+
+    return results
+
+
+def resample_cell(popular, unpopular, n_resamples: int, confidence: float, seed) -> tuple:
+    """
+    Two-sided permutation p-value and percentile bootstrap interval of the difference
+    in means of one cell, computed in batches of resamples
+    """
+    rng = np.random.default_rng(seed)
+    n1, n2 = len(popular), len(unpopular)
+    if n1 == 0 or n2 == 0:
+        return np.nan, np.nan, np.nan
+
+    pooled = np.concatenate([popular, unpopular])
+    observed = popular.mean() - unpopular.mean()
+    batch = max(1, RESAMPLE_BATCH_VALUES // (n1 + n2))
+
+    permuted_diffs, bootstrap_diffs = [], []
+    for start in range(0, n_resamples, batch):
+        size = min(batch, n_resamples - start)
+
+        # Shuffle the group labels, every row of order is one permutation
+        order = rng.permuted(np.tile(np.arange(n1 + n2), (size, 1)), axis=1)
+        sums = pooled[order[:, :n1]].sum(axis=1)
+        permuted_diffs.append(sums / n1 - (pooled.sum() - sums) / n2)
+
+        # Resample both groups with replacement
+        bootstrap_diffs.append(popular[rng.integers(0, n1, (size, n1))].mean(axis=1)
+                               - unpopular[rng.integers(0, n2, (size, n2))].mean(axis=1))
+
+    permuted_diffs = np.concatenate(permuted_diffs)
+    bootstrap_diffs = np.concatenate(bootstrap_diffs)
+
+    # Relative tolerance, so permutations equal to the observed difference up to
+    # rounding count as at least as extreme
+    extreme = np.abs(permuted_diffs) >= np.abs(observed) * (1 - 1e-12)
+    permutation_p = (extreme.sum() + 1) / (n_resamples + 1)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(bootstrap_diffs, [tail, 100 - tail])
+    return permutation_p, low, high
+
+
+def resampled_tests(samples: pd.DataFrame, cells: pd.Index, n_resamples: int, confidence: float = 0.95, workers: int = None, seed: int = 0) -> pd.DataFrame:
+    """
+    Permutation p-values and bootstrap intervals of every cell, with the cells spread
+    over a process pool. Every cell gets its own seed, so the results don't depend on
+    the number of workers.
+    """
+    grouped = samples.groupby([*CELL_COLUMNS, samples['pop_unpop'].to_numpy() == 1])['value']
+    values = {key: group.to_numpy() for key, group in grouped}
+    empty = np.array([])
+    popular = [values.get((*cell, True), empty) for cell in cells]
+    unpopular = [values.get((*cell, False), empty) for cell in cells]
+    seeds = np.random.SeedSequence(seed).spawn(len(cells))
+
+    arguments = (popular, unpopular, repeat(n_resamples), repeat(confidence), seeds)
+    workers = min(workers or os.cpu_count(), len(cells)) or 1
+    if workers == 1:
+        results = list(map(resample_cell, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(resample_cell, *arguments,
+                                        chunksize=max(1, len(cells) // (workers * 4))))
+
+    return pd.DataFrame(results, index=cells,
+                        columns=['permutation_p', 'bootstrap_low', 'bootstrap_high'])
+
+
+@instrumented()
+def compare_pop_unpop(df: pd.DataFrame, metrics=METRICS, windows=None, unit: str = 'channel', n_resamples: int = 0, confidence: float = 0.95, workers: int = None, seed: int = 0, category_column: str = 'category') -> pd.DataFrame:
+    """
+    Compare popular and unpopular channels on every metric, category and year window.
+
+    Parameters:
+    - df: Cleaned combined frame, one category or several with a category column.
+    - metrics: Numeric columns that are compared.
+    - windows: Optional list of (first_year, last_year) windows (see year_windows),
+      all years by default.
+    - unit: 'channel' compares per channel means, 'video' compares videos.
+    - n_resamples: Number of permutations and bootstrap resamples per cell, 0 skips them.
+    - confidence: Confidence level of the bootstrap interval of the mean difference.
+    - workers: Number of processes for the resampling (default: all cores).
+    - seed: Seed of the resampling.
+    - category_column: Column holding the category.
+
+    Returns one row per (category, years, metric) with the group sizes and means, the
+    Welch t-test and Mann-Whitney U statistics and p-values and, with n_resamples, the
+    permutation p-value and bootstrap interval of mean_popular - mean_unpopular.
+    """
+    samples = test_samples(df, metrics, windows, unit, category_column)
+    results = batched_tests(samples)
+
+    if n_resamples:
+        results = results.join(resampled_tests(
+            samples, results.index, n_resamples, confidence, workers, seed))
+
+    # Metrics in the given order instead of alphabetically
+    results = results.reset_index()
+    results['metric'] = pd.Categorical(results['metric'], categories=list(metrics))
+    results = results.sort_values(CELL_COLUMNS, ignore_index=True)
+    results['metric'] = results['metric'].astype(str)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Test popular against unpopular channels on every metric, category and year window')
+    parser.add_argument('--store', required=True, help='Parquet store written by storage.save_videos')
+    parser.add_argument('--categories', nargs='+', default=None)
+    parser.add_argument('--metrics', nargs='+', default=METRICS)
+    parser.add_argument('--unit', choices=['channel', 'video'], default='channel')
+    parser.add_argument('--window-size', type=int, default=None,
+                        help='Years per window (default: one window of all years)')
+    parser.add_argument('--window-step', type=int, default=None,
+                        help='Years between window starts (default: 1)')
+    parser.add_argument('--resamples', type=int, default=0,
+                        help='Permutations and bootstrap resamples per test')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='pop_unpop_tests.csv')
+    args = parser.parse_args(argv)
+
+    df = storage.load_videos(args.store, categories=args.categories)
+    windows = None
+    if args.window_size is not None:
+        windows = year_windows(df['publishingYear'].unique(), args.window_size, args.window_step)
+
+    results = compare_pop_unpop(df, args.metrics, windows, args.unit, args.resamples,
+                                workers=args.workers, seed=args.seed)
+    results.to_csv(args.out, index=False)
+    print(results.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+import ast
+import os
+import time
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import fileio
+import utils
+
+# Parsed video frames are stored as Parquet under <root>/category=<name>/pop_unpop=<0|1>/
+PARTITIONING = ds.partitioning(
+    pa.schema([('category', pa.string()), ('pop_unpop', pa.int64())]), flavor='hive')
+
+# Columns with few distinct values that are loaded back as pandas categoricals
+CATEGORICAL_COLUMNS = ['channelTitle', 'category', 'definition']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday',
+            'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+ORDERED_CATEGORIES = {'publishDayName': WEEKDAYS, 'publishingMonthName': MONTHS}
+
+# Columns that are integers in some chunks and float (NaN) in others, always stored as float
+STREAM_FLOAT_COLUMNS = ['viewCount', 'likeCount', 'commentCount',
+                        'durationSecs', 'titleLength']
+# Text columns of the raw csv, read as strings even when a chunk holds only NaN
+STREAM_TEXT_COLUMNS = ['video_id', 'channelTitle', 'title',
+                       'description', 'tags', 'definition']
+
+# Files of the comment store written by save_comments, partition columns included
+COMMENT_ROWS_SCHEMA = pa.schema([('video_id', pa.string()), ('comment_rank', pa.int16()),
+                                 ('text_hash', pa.uint64()), ('saved_at', pa.int64()),
+                                 ('category', pa.string()), ('pop_unpop', pa.int64())])
+COMMENT_TEXTS_SCHEMA = pa.schema([('text_hash', pa.uint64()), ('text', pa.string())])
+
+
+def save_videos(df: pd.DataFrame, root: str, category: str) -> None:
+    """
+    Persist an already parsed video frame (output of parse_cols and add_pop_unpop_col
+    or combine_pop_unpop_df) as Parquet, partitioned by category and pop_unpop.
+    Existing files of the same category and pop_unpop partitions are replaced.
+    """
+    if 'pop_unpop' not in df.columns:
+        raise ValueError(
+            "Add the 'pop_unpop' column with add_pop_unpop_col before saving")
+
+    table = videos_table(df, category)
+    ds.write_dataset(table, root, format='parquet', partitioning=PARTITIONING,
+                     basename_template='part-{i}.parquet',
+                     existing_data_behavior='delete_matching')
+
+
+def videos_table(df: pd.DataFrame, category: str, schema: pa.Schema = None) -> pa.Table:
+    """
+    Convert a parsed video frame to the Arrow table written to the store
+    """
+    df = df.assign(category=category)
+    # Strings are stored plainly (Parquet dictionary-encodes them anyway) so that
+    # filters on channelTitle can be pushed down to the files
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(str)
+
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def stream_schema(table: pa.Table) -> pa.Schema:
+    """
+    Schema that every chunk of a streamed file is written with, taken from the first
+    chunk but without the types that only hold for that chunk (all null or empty lists)
+    """
+    fields = []
+    for field in table.schema:
+        if field.name == 'tagsList':
+            field = field.with_type(pa.list_(pa.string()))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def delete_partition(root: str, category: str, pop_unpop: int) -> None:
+    """
+    Delete the stored files of one category and pop_unpop partition
+    """
+    if not os.path.isdir(root):
+        return
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+    condition = (ds.field('category') == category) & (ds.field('pop_unpop') == pop_unpop)
+    for fragment in dataset.get_fragments(filter=condition):
+        os.remove(fragment.path)
+
+
+def stream_videos(csv_path: str, root: str, category: str, pop: bool, chunksize: int = 100_000) -> dict:
+    """
+    Parse a *_vid.csv dump chunk by chunk and append every parsed chunk to the store.
+
+    Parameters:
+    - csv_path: Path of the raw video csv, e.g. './tech/top_tech_vid.csv'.
+    - root: Directory of the store, the same one load_videos reads.
+    - category: Category the videos are saved under.
+    - pop: True for popular channels, False for unpopular ones.
+    - chunksize: Number of csv rows parsed at a time.
+
+    Only one chunk is held in memory at a time, so memory stays bounded whatever the
+    size of the file. Existing files of the same category and pop_unpop partition are
+    replaced. Prints the same summary as parse_cols for the whole file and returns
+    the summed counts.
+    """
+    counts = {'rows_before': 0, 'dropped_published_at': 0,
+              'dropped_view_count': 0, 'rows_after': 0}
+    schema = None
+
+    # Cleared up front, so a file without any valid row also replaces the old videos
+    delete_partition(root, category, int(pop))
+
+    chunks = pd.read_csv(csv_path, index_col=0, chunksize=chunksize,
+                         dtype={column: 'object' for column in STREAM_TEXT_COLUMNS})
+    for number, chunk in enumerate(chunks):
+        chunk, chunk_counts = utils.parse_cols_with_counts(chunk)
+        for key, value in chunk_counts.items():
+            counts[key] += value
+        if chunk.empty:
+            continue
+
+        chunk = utils.add_pop_unpop_col(chunk, pop)
+        for column in STREAM_FLOAT_COLUMNS:
+            chunk[column] = chunk[column].astype('float64')
+
+        if schema is None:
+            table = videos_table(chunk, category)
+            schema = stream_schema(table)
+            table = table.cast(schema)
+        else:
+            table = videos_table(chunk, category, schema)
+
+        # Every chunk adds its files next to the ones of the previous chunks
+        ds.write_dataset(table, root, format='parquet', partitioning=PARTITIONING,
+                         basename_template=f'part-{number:06d}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+
+    utils.print_parse_counts(counts)
+    return counts
+
+
+def load_videos(root: str, categories=None, columns=None, years=None, channels=None, pop_unpop=None) -> pd.DataFrame:
+    """
+    Load parsed videos saved with save_videos, without re-parsing any column.
+
+    Parameters:
+    - root: Directory the videos were saved to.
+    - categories: Optional list of categories to load, e.g. ['tech'].
+    - columns: Optional list of columns to read, all columns by default.
+    - years: Optional list of publishing years to keep.
+    - channels: Optional list of channel titles to keep.
+    - pop_unpop: Optional 1 or 0 to load only popular or unpopular channels.
+
+    The filters are pushed down to the Parquet reader, so partitions and row groups that
+    can't match are skipped. Returns a frame with categorical channel, category, day and
+    month name columns. tagsList values come back as numpy arrays instead of lists.
+    """
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+
+    conditions = []
+    if categories is not None:
+        conditions.append(ds.field('category').isin(list(categories)))
+    if pop_unpop is not None:
+        conditions.append(ds.field('pop_unpop') == pop_unpop)
+    if years is not None:
+        conditions.append(ds.field('publishingYear').isin(list(years)))
+    if channels is not None:
+        conditions.append(ds.field('channelTitle').isin(list(channels)))
+
+    condition = None
+    for expression in conditions:
+        condition = expression if condition is None else condition & expression
+
+    df = dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+    # Partitions are read in path order (pop_unpop=0 first), put popular videos first
+    # again within every category like combine_pop_unpop_df does
+    if 'pop_unpop' in df.columns:
+        by = ['category', 'pop_unpop'] if 'category' in df.columns else ['pop_unpop']
+        df = df.sort_values(by, ascending=[True] * (len(by) - 1) + [False],
+                            kind='stable', ignore_index=True)
+
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    for column, categories in ORDERED_CATEGORIES.items():
+        if column in df.columns:
+            df[column] = pd.Categorical(
+                df[column], categories=categories, ordered=True)
+
+    return df
+
+
+def normalize_comments(comments: pd.DataFrame) -> tuple:
+    """
+    Split a comments frame (from fetch.get_comments_in_videos, or read from a
+    *_comments.csv file where every list is stored as a string) into
+    - rows: one row per (video_id, comment_rank) with the hash of the comment text,
+      comment_rank 0 being the first comment returned by the API
+    - texts: every distinct text once, with its text_hash
+    """
+    lists = comments['comments'].map(
+        lambda value: ast.literal_eval(value) if isinstance(value, str) else value)
+    lists = lists.map(lambda value: value if isinstance(value, list) else [])
+
+    lengths = lists.map(len).to_numpy()
+    values = np.fromiter(map(str, chain.from_iterable(lists)), dtype=object, count=lengths.sum())
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    hashes = pd.util.hash_array(values)
+
+    rows = pd.DataFrame({
+        'video_id': np.repeat(comments['video_id'].to_numpy(dtype=object), lengths),
+        'comment_rank': (np.arange(len(values)) - starts).astype('int16'),
+        'text_hash': hashes,
+    })
+    texts = pd.DataFrame({'text_hash': hashes, 'text': values}).drop_duplicates('text_hash')
+    return rows, texts.reset_index(drop=True)
+
+
+def save_comments(comments: pd.DataFrame, root: str, category: str, pop: bool, replace: bool = True) -> dict:
+    """
+    Persist the comments of one category and pop_unpop group as Parquet:
+    <root>/rows/category=<name>/pop_unpop=<0|1>/ holds one row per (video_id,
+    comment_rank) and <root>/texts/ every distinct comment text once, keyed by its hash.
+    Keep root apart from the video store, the video dataset would pick up these files.
+
+    Parameters:
+    - comments: Comments frame, see normalize_comments.
+    - root: Directory of the comment store.
+    - category: Category the comments are saved under.
+    - pop: True for popular channels, False for unpopular ones.
+    - replace: Replace the stored rows of the category and group, False appends them
+      (e.g. the comments of the new videos returned by fetch.sync_channels).
+
+    Texts already stored (by any category) are not written again. Returns the number of
+    rows and of new texts written.
+    """
+    rows, texts = normalize_comments(comments)
+    saved_at = time.time_ns()
+    rows = rows.assign(saved_at=saved_at, category=category, pop_unpop=int(pop))
+
+    # Every row is tagged with its save, load_comments keeps the newest save of a video
+    ds.write_dataset(pa.Table.from_pandas(rows, schema=COMMENT_ROWS_SCHEMA, preserve_index=False),
+                     os.path.join(root, 'rows'), format='parquet', partitioning=PARTITIONING,
+                     basename_template=f'part-{saved_at}-{{i}}.parquet',
+                     existing_data_behavior='delete_matching' if replace else 'overwrite_or_ignore')
+
+    texts_dir = os.path.join(root, 'texts')
+    if os.path.isdir(texts_dir):
+        stored = ds.dataset(texts_dir, format='parquet').to_table(columns=['text_hash'])
+        texts = texts[~texts['text_hash'].isin(stored.column('text_hash').to_numpy())]
+    if len(texts):
+        os.makedirs(texts_dir, exist_ok=True)
+        with fileio.atomic_path(os.path.join(texts_dir, f'part-{saved_at}.parquet')) as tmp_path:
+            texts.to_parquet(tmp_path, index=False)
+
+    return {'rows': len(rows), 'new_texts': len(texts)}
+
+
+def load_comments(root: str, categories=None, video_ids=None, pop_unpop=None, with_text: bool = True) -> pd.DataFrame:
+    """
+    Load comments saved with save_comments, one row per (video_id, comment_rank).
+
+    With with_text the comment is added as a categorical 'text' column: every distinct
+    text is held once however many videos it appears under (e.g. repeated giveaway
+    comments), the rows only hold integer codes. Filters work like load_videos.
+
+    A video saved several times (e.g. appended again by a later sync) keeps only the
+    comments of its newest save. Nothing saved yet gives an empty frame.
+    """
+    # A store where every saved list was empty has no files, it loads as an empty frame
+    def store_dataset(name, schema, partitioning=None):
+        path = os.path.join(root, name)
+        return ds.dataset(path if os.path.isdir(path) else [], schema=schema,
+                          format='parquet', partitioning=partitioning)
+
+    dataset = store_dataset('rows', COMMENT_ROWS_SCHEMA, PARTITIONING)
+
+    conditions = []
+    if categories is not None:
+        conditions.append(ds.field('category').isin(list(categories)))
+    if pop_unpop is not None:
+        conditions.append(ds.field('pop_unpop') == pop_unpop)
+    if video_ids is not None:
+        conditions.append(ds.field('video_id').isin(list(video_ids)))
+
+    condition = None
+    for expression in conditions:
+        condition = expression if condition is None else condition & expression
+
+    df = dataset.to_table(filter=condition).to_pandas()
+    df = df[df['saved_at'] == df.groupby('video_id')['saved_at'].transform('max')]
+    df = df.drop(columns='saved_at').drop_duplicates(['video_id', 'comment_rank'], keep='last')
+    df = df.sort_values(['category', 'pop_unpop', 'video_id', 'comment_rank'],
+                        ascending=[True, False, True, True], kind='stable', ignore_index=True)
+    for column in ['video_id', 'category']:
+        df[column] = df[column].astype('category')
+
+    if with_text:
+        texts = store_dataset('texts', COMMENT_TEXTS_SCHEMA).to_table().to_pandas()
+        texts = texts.drop_duplicates('text_hash')
+        codes = pd.Index(texts['text_hash']).get_indexer(df['text_hash'])
+        df['text'] = pd.Categorical.from_codes(codes, categories=texts['text'])
+
+    return df
+
+
+def join_videos(comments: pd.DataFrame, videos: pd.DataFrame, columns) -> pd.DataFrame:
+    """
+    Add video columns (e.g. ['channelTitle', 'pop_unpop', 'viewCount']) to every comment
+    row by video_id. The video of every row is looked up once with an indexer and the
+    columns are gathered with take, no merged copy of both frames is built. Comments of
+    videos not in videos get missing values.
+    """
+    index = pd.Index(videos['video_id'])
+    if not index.is_unique:
+        repeated = index[index.duplicated()].unique()
+        raise ValueError(
+            f"videos has repeated video_ids ({', '.join(map(str, repeated[:5]))}), drop the duplicates before joining")
+    positions = index.get_indexer(comments['video_id'])
+    joined = comments.copy(deep=False)
+    for column in columns:
+        joined[column] = pd.api.extensions.take(videos[column].array, positions, allow_fill=True)
+    return joined
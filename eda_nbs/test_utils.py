@@ -0,0 +1,112 @@
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import utils
+
+
+def raw_videos() -> pd.DataFrame:
+    """
+    A few raw API rows covering the cases parse_cols handles: UTC and offset timestamps
+    (one crossing midnight and the new year), an unparsable date, a non-numeric and a
+    zero viewCount, missing tags and escaped tags
+    """
+    return pd.DataFrame({
+        'video_id': ['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+        'channelTitle': ['One', 'One', 'Two', 'Two', 'Three', 'Three', 'Three'],
+        'title': ['First', 'Second one', 'Third', 'Fourth', 'Fifth', 'Sixth', 'Seventh'],
+        'description': ['x', 'y', 'z', 'w', 'v', 'u', 't'],
+        'tags': ["['a', 'b']", None, "['it\\'s']", '[]', "['c']", "['d', \"e\"]", "['f']"],
+        'publishedAt': ['2020-06-01T10:00:00Z', '2020-06-01T10:00:00+02:00',
+                        '2020-12-31T23:30:00-05:00', 'garbage', '2021-01-01T00:15:00+01:00',
+                        '2019-03-04T05:06:07.123Z', '2022-07-08T09:10:11Z'],
+        'viewCount': ['100', '2000', '30', '40', 'many', '0', '70000'],
+        'likeCount': ['10', '20', '3', '4', '5', '6', '700'],
+        'commentCount': ['1', '2', '0', '4', '5', '6', '70'],
+        'duration': ['PT1M30S', 'PT1H2M3S', 'P0D', 'PT5S', 'PT10M', 'P1DT2H', 'PT45S'],
+        'definition': ['hd', 'hd', 'sd', 'hd', 'hd', 'sd', 'hd'],
+        'caption': ['false', 'true', 'false', 'false', 'true', 'false', 'false'],
+    })
+
+
+def test_parse_cols_vectorized_matches_parse_cols():
+    expected = utils.parse_cols(raw_videos())
+    result = utils.parse_cols_vectorized(raw_videos())
+
+    assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_parse_cols_vectorized_keeps_local_clock_time():
+    result = utils.parse_cols_vectorized(raw_videos()).set_index('video_id')
+
+    assert str(result.loc['b', 'publishingTime']) == '10:00:00'
+    assert result.loc['c', ['publishingYear', 'publishingMonth']].tolist() == [2020, 12]
+    assert result.loc['c', 'publishDayName'] == 'Thursday'
+
+
+def loop_percentiles_df(df, percentiles, year_column='publishingYear', column='viewCount'):
+    """
+    The former per-channel, per-year loop of calculate_percentiles_df
+    """
+    data = {0: {}, 1: {}}
+    for channel in df['channelTitle'].unique():
+        channel_df = df[df['channelTitle'] == channel]
+        group = data[0 if channel_df['pop_unpop'].iloc[0] == 0 else 1]
+        for year in channel_df[year_column].unique():
+            year_df = channel_df[channel_df[year_column] == year]
+            for percentile in percentiles:
+                group.setdefault(percentile, {}).setdefault(channel, {})[year] = \
+                    year_df[column].quantile(float(percentile)) / 1_000_000
+
+    def table(group):
+        return pd.DataFrame.from_dict({(percentile, channel): group[percentile][channel]
+                                       for percentile in percentiles if percentile in group
+                                       for channel in group[percentile]},
+                                      orient='index').transpose()
+
+    return table(data[1]), table(data[0])
+
+
+def loop_remove_outliers(df, threshold=1.5):
+    """
+    The former per-channel, per-year loop of remove_outliers
+    """
+    parts = []
+    for channel in df['channelTitle'].unique():
+        channel_df = df[df['channelTitle'] == channel]
+        for year in channel_df['publishingYear'].unique():
+            year_df = channel_df[channel_df['publishingYear'] == year]
+            q1, q3 = year_df['viewCount'].quantile(0.25), year_df['viewCount'].quantile(0.75)
+            iqr = q3 - q1
+            parts.append(year_df[(year_df['viewCount'] >= q1 - threshold * iqr)
+                                 & (year_df['viewCount'] <= q3 + threshold * iqr)])
+    return pd.concat(parts)
+
+
+def channel_years() -> pd.DataFrame:
+    """
+    Channels with different years in a shuffled order, B and E lack the first year seen
+    """
+    return pd.DataFrame({
+        'channelTitle': ['A', 'A', 'B', 'C', 'C', 'D', 'E', 'A', 'C', 'D', 'E', 'A', 'A', 'A'],
+        'publishingYear': [2020, 2021, 2021, 2020, 2022, 2019, 2022, 2020, 2020, 2019, 2021, 2021, 2020, 2020],
+        'pop_unpop': [0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 1, 0, 0, 0],
+        'viewCount': [1e6, 2e6, 3e6, 4e6, 5e6, 6e6, 7e6, 1.5e6, 4.5e6, 6.5e6, 8e6, 2.5e6, 1.2e6, 9e7],
+    })
+
+
+def test_calculate_percentiles_df_matches_loop():
+    percentiles = ['0.25', '0.5', '0.9']
+    expected = loop_percentiles_df(channel_years(), percentiles)
+    result = utils.calculate_percentiles_df(channel_years(), percentiles)
+
+    for result_table, expected_table in zip(result, expected):
+        assert_frame_equal(result_table, expected_table)
+    assert list(result[1].columns[:3]) == [('0.25', 'A'), ('0.25', 'C'), ('0.5', 'A')]
+
+
+def test_remove_outliers_matches_loop():
+    expected = loop_remove_outliers(channel_years())
+    result = utils.remove_outliers(channel_years())
+
+    assert_frame_equal(result, expected)
+    assert 13 not in result.index
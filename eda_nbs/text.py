@@ -0,0 +1,193 @@
+import ast
+import re
+import sys
+from collections import Counter
+from functools import lru_cache, partial
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from instrumentation import instrumented
+
+# Characters title_analysis.ipynb removes from titles before tokenizing
+CLEAN_PATTERN = re.compile(r'[^a-zA-Z0-9\s]')
+
+
+class Vocabulary:
+    """
+    Interned tokens and their integer ids. Every distinct token is stored once and
+    documents are kept as arrays of ids, so a vocabulary can be shared by several
+    columns or grown batch by batch.
+    """
+
+    def __init__(self, tokens=()):
+        self.ids = {}
+        self.tokens = []
+        self.intern(tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def intern(self, tokens) -> np.ndarray:
+        """
+        Ids of the given tokens, new tokens are added to the vocabulary
+        """
+        new_tokens = [token for token, token_id in zip(tokens, map(self.ids.get, tokens))
+                      if token_id is None]
+        new_tokens = list(map(sys.intern, dict.fromkeys(new_tokens)))
+        self.ids.update(zip(new_tokens, range(len(self.tokens), len(self.tokens) + len(new_tokens))))
+        self.tokens.extend(new_tokens)
+        return np.fromiter(map(self.ids.__getitem__, tokens), dtype='int64', count=len(tokens))
+
+
+@lru_cache()
+def english_stopwords() -> frozenset:
+    """
+    NLTK's English stop words (needs nltk and nltk.download('stopwords'))
+    """
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words('english'))
+
+
+def parse_comments(comments: pd.Series) -> pd.Series:
+    """
+    One row per comment from a *_comments.csv 'comments' column, which holds the list
+    of comments of every video as a string. The index of the video row is kept.
+    """
+    parsed = comments.dropna().map(ast.literal_eval).explode()
+    return parsed.dropna().astype(str)
+
+
+def normalize_texts(texts, clean: bool = False, lowercase: bool = False) -> list:
+    """
+    Texts as a list of strings, missing values as empty strings, optionally cleaned
+    with CLEAN_PATTERN and lowercased
+    """
+    texts = pd.Series(texts, dtype=object).fillna('').astype(str).tolist()
+    if clean:
+        texts = list(map(partial(CLEAN_PATTERN.sub, ''), texts))
+    if lowercase:
+        texts = list(map(str.lower, texts))
+    return texts
+
+
+@instrumented()
+def tokenize(texts, stop_words=(), min_length: int = 1, clean: bool = False, lowercase: bool = False, vocabulary: Vocabulary = None):
+    """
+    Tokenize a whole column at once.
+
+    Parameters:
+    - texts: Series or list of strings, missing values are empty documents.
+    - stop_words: Tokens to drop, e.g. english_stopwords().
+    - min_length: Drop tokens shorter than this.
+    - clean: Remove every character except letters, digits and whitespace first, like
+      the re.sub in title_analysis.ipynb. Otherwise tokens are split on whitespace
+      like str(x).split() in the category notebooks.
+    - lowercase: Lowercase the texts before tokenizing.
+    - vocabulary: Vocabulary to add the tokens to, a new one by default.
+
+    Returns (indptr, ids, vocabulary): the token ids of document i are
+    ids[indptr[i]:indptr[i + 1]], in the order they appear.
+
+    Stop words and short tokens are filtered on the distinct tokens, not per occurrence.
+    """
+    texts = normalize_texts(texts, clean, lowercase)
+
+    # Flatten all tokens into one array and factorize it, every distinct token is
+    # then looked up once instead of once per occurrence
+    rows = [row.split() for row in texts]
+    lengths = np.fromiter(map(len, rows), dtype='int64', count=len(rows))
+    flat = np.fromiter(chain.from_iterable(rows), dtype=object, count=lengths.sum())
+    codes, uniques = pd.factorize(flat)
+
+    keep = np.fromiter((len(token) >= min_length and token not in stop_words for token in uniques),
+                       dtype=bool, count=len(uniques))
+    vocabulary = Vocabulary() if vocabulary is None else vocabulary
+    unique_ids = np.full(len(uniques), -1, dtype='int64')
+    unique_ids[keep] = vocabulary.intern(uniques[keep])
+
+    ids = unique_ids[codes]
+    kept = ids != -1
+    documents = np.repeat(np.arange(len(texts)), lengths)
+    indptr = np.zeros(len(texts) + 1, dtype='int64')
+    np.cumsum(np.bincount(documents[kept], minlength=len(texts)), out=indptr[1:])
+    return indptr, ids[kept], vocabulary
+
+
+def with_bigrams(indptr, ids, vocabulary: Vocabulary):
+    """
+    Add the bigrams of every document of the output of tokenize, as 'first second'
+    tokens interned in the same vocabulary. Returns (indptr, ids) with the unigram ids
+    of every document followed by its bigram ids.
+
+    Bigrams are built from the kept tokens, i.e. after stop words are removed, like
+    nltk.bigrams over the tokenized titles.
+    """
+    n_documents = len(indptr) - 1
+    documents = np.repeat(np.arange(n_documents), np.diff(indptr))
+
+    # Consecutive tokens of the same document
+    same_document = documents[:-1] == documents[1:]
+    first, second = ids[:-1][same_document], ids[1:][same_document]
+
+    # Distinct pairs are joined into strings once
+    size = len(vocabulary)
+    pairs, codes = np.unique(first * size + second, return_inverse=True)
+    pair_tokens = [f'{vocabulary.tokens[a]} {vocabulary.tokens[b]}'
+                   for a, b in zip(*np.divmod(pairs, size))]
+    bigram_ids = vocabulary.intern(pair_tokens)[codes]
+
+    all_documents = np.concatenate([documents, documents[:-1][same_document]])
+    order = np.argsort(all_documents, kind='stable')
+    counts = np.bincount(all_documents, minlength=n_documents)
+    new_indptr = np.zeros(n_documents + 1, dtype='int64')
+    np.cumsum(counts, out=new_indptr[1:])
+    return new_indptr, np.concatenate([ids, bigram_ids])[order]
+
+
+def document_term_matrix(indptr, ids, vocabulary: Vocabulary) -> sparse.csr_matrix:
+    """
+    Sparse (documents x tokens) count matrix of the output of tokenize
+    """
+    matrix = sparse.csr_matrix((np.ones(len(ids), dtype='int32'), ids, indptr),
+                               shape=(len(indptr) - 1, len(vocabulary)))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def frequencies(ids, vocabulary: Vocabulary) -> Counter:
+    """
+    Counter of token -> number of occurrences of the output of tokenize
+    """
+    counts = np.bincount(ids, minlength=len(vocabulary))
+    present = np.flatnonzero(counts)
+    return Counter(dict(zip([vocabulary.tokens[i] for i in present], counts[present].tolist())))
+
+
+def term_frequencies(texts, stop_words=(), min_length: int = 1, clean: bool = False, lowercase: bool = False) -> Counter:
+    """
+    Token counts of a column (see tokenize for the parameters), e.g. the input of
+    WordCloud.generate_from_frequencies or nltk's FreqDist
+    """
+    texts = normalize_texts(texts, clean, lowercase)
+
+    # Count every token, then drop the stop words and short tokens from the distinct ones
+    counts = Counter(chain.from_iterable(map(str.split, texts)))
+    for token in [token for token in counts if len(token) < min_length or token in stop_words]:
+        del counts[token]
+    return counts
+
+
+def generate_wordcloud(token_counts, **wordcloud_kwargs):
+    """
+    WordCloud of token counts, e.g. from term_frequencies.
+
+    Unlike WordCloud.generate on the joined text, the counts are used as they are:
+    wordcloud's own stop words, plural merging and collocations are not applied.
+    """
+    from wordcloud import WordCloud
+
+    return WordCloud(**wordcloud_kwargs).generate_from_frequencies(token_counts)
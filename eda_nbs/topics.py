@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import fileio
+import text
+from callback_cache import dataset_version
+from instrumentation import instrumented
+
+# Files of a cached corpus, under <cache_dir>/<version>/
+MATRIX_FILE = 'matrix.npz'
+TERMS_FILE = 'terms.json'
+
+
+def corpus_settings(stop_words=(), min_length: int = 3, max_df: float = 0.85, min_df: int = 1, max_features: int = 1000) -> dict:
+    """
+    Tokenizer and pruning settings of a corpus, part of its cache key
+    """
+    return {'stop_words': sorted(stop_words), 'min_length': min_length, 'max_df': max_df,
+            'min_df': min_df, 'max_features': max_features}
+
+
+def build_corpus(texts, settings: dict) -> tuple:
+    """
+    Bag-of-words (documents x terms) count matrix of the texts, like the CountVectorizer
+    in title_analysis.ipynb: texts are cleaned and lowercased, terms in more than max_df
+    of the documents or fewer than min_df documents are dropped and only the
+    max_features most frequent terms are kept. Returns (matrix, terms), terms sorted.
+    """
+    indptr, ids, vocabulary = text.tokenize(texts, frozenset(settings['stop_words']),
+                                            settings['min_length'], clean=True, lowercase=True)
+    matrix = text.document_term_matrix(indptr, ids, vocabulary)
+
+    # Document frequency and total count of every term
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    totals = np.asarray(matrix.sum(axis=0)).ravel()
+    keep = (document_frequency <= settings['max_df'] * matrix.shape[0]) \
+        & (document_frequency >= settings['min_df'])
+    columns = np.flatnonzero(keep)
+    if settings['max_features'] is not None and len(columns) > settings['max_features']:
+        # Most frequent first, ties broken by the term like CountVectorizer's sort
+        order = np.lexsort((np.array(vocabulary.tokens)[columns], -totals[columns]))
+        columns = columns[order[:settings['max_features']]]
+
+    terms = [vocabulary.tokens[column] for column in columns]
+    columns = columns[np.argsort(terms, kind='stable')]
+    return matrix[:, columns].tocsr(), sorted(terms)
+
+
+def vectorize(texts, terms, settings: dict) -> sparse.csr_matrix:
+    """
+    Count matrix of new texts over the terms of an existing corpus, terms the corpus
+    doesn't have are dropped (e.g. titles fetched after the model was trained)
+    """
+    vocabulary = text.Vocabulary(terms)
+    indptr, ids, _ = text.tokenize(texts, frozenset(settings['stop_words']),
+                                   settings['min_length'], clean=True, lowercase=True,
+                                   vocabulary=vocabulary)
+    matrix = text.document_term_matrix(indptr, ids, vocabulary)
+    return matrix[:, :len(terms)].tocsr()
+
+
+def corpus_version(df: pd.DataFrame, text_column: str, settings: dict) -> str:
+    """
+    Cache key of the corpus of a frame: the content of its text column and the settings
+    """
+    digest = hashlib.sha256(dataset_version(df[[text_column]]).encode())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+@instrumented()
+def cached_corpus(df: pd.DataFrame, cache_dir: str = 'topic_cache', text_column: str = 'title', settings: dict = None) -> tuple:
+    """
+    Corpus of df[text_column] (see build_corpus), read from <cache_dir>/<version>/ when
+    the same texts were vectorized with the same settings before.
+
+    Returns (matrix, terms, version), matrix rows are in the order of df.
+    """
+    settings = corpus_settings() if settings is None else settings
+    version = corpus_version(df, text_column, settings)
+    directory = os.path.join(cache_dir, version)
+
+    try:
+        matrix = sparse.load_npz(os.path.join(directory, MATRIX_FILE)).tocsr()
+        with open(os.path.join(directory, TERMS_FILE)) as f:
+            terms = json.load(f)
+        return matrix, terms, version
+    except (OSError, ValueError):
+        pass
+
+    matrix, terms = build_corpus(df[text_column], settings)
+    os.makedirs(directory, exist_ok=True)
+
+    def path(name):
+        return os.path.join(directory, name)
+
+    # Files are moved into place once written, the terms file last, so a corpus with a
+    # terms file is complete
+    with fileio.atomic_path(path(MATRIX_FILE)) as tmp_path:
+        sparse.save_npz(tmp_path, matrix)
+    with fileio.atomic_path(path(TERMS_FILE)) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(terms, f)
+    return matrix, terms, version
+
+
+@instrumented()
+def train_topics(matrix, n_topics: int = 5, passes: int = 15, batch_size: int = 128, workers: int = -1, seed: int = 42):
+    """
+    Online (mini-batch) LDA over a corpus, the E-step of every mini-batch runs on
+    workers cores (-1: all cores). Needs scikit-learn.
+
+    Parameters:
+    - matrix: Count matrix, e.g. from cached_corpus.
+    - n_topics: Number of topics.
+    - passes: Number of passes over the corpus, like gensim's passes.
+    - batch_size: Documents per mini-batch.
+    - workers: Number of processes, passed to n_jobs.
+    - seed: Random state of the model.
+    """
+    from sklearn.decomposition import LatentDirichletAllocation
+
+    model = LatentDirichletAllocation(n_components=n_topics, learning_method='online',
+                                      max_iter=passes, batch_size=batch_size,
+                                      n_jobs=workers, random_state=seed)
+    return model.fit(matrix)
+
+
+@instrumented()
+def update_topics(model, texts, terms, settings: dict):
+    """
+    Update a trained model with new texts, one online step per mini-batch. The new
+    texts are counted over the existing terms (see vectorize).
+    """
+    matrix = vectorize(texts, terms, settings)
+    for start in range(0, matrix.shape[0], model.batch_size):
+        model.partial_fit(matrix[start:start + model.batch_size])
+    return model
+
+
+def topic_terms(model, terms, n: int = 10) -> pd.DataFrame:
+    """
+    The n highest weighted terms of every topic, one row per topic
+    """
+    terms = np.asarray(terms, dtype=object)
+    top = np.argsort(-model.components_, axis=1)[:, :n]
+    return pd.DataFrame(terms[top], index=pd.RangeIndex(len(top), name='topic'),
+                        columns=[f'term_{i}' for i in range(1, top.shape[1] + 1)])
+
+
+@instrumented()
+def assign_topics(df: pd.DataFrame, model, matrix) -> pd.DataFrame:
+    """
+    Copy of df with the most likely topic of every row in 'topic' and its probability
+    in 'topic_weight'. Rows without any corpus term get topic -1.
+    """
+    weights = model.transform(matrix)
+    empty = np.diff(matrix.indptr) == 0
+    df = df.copy()
+    df['topic'] = np.where(empty, -1, weights.argmax(axis=1))
+    df['topic_weight'] = np.where(empty, np.nan, weights.max(axis=1))
+    return df
+
+
+def topic_shares(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Share of the videos of popular and unpopular channels in every topic, one row per
+    topic and one column per pop_unpop value
+    """
+    assigned = df[df['topic'] != -1]
+    return pd.crosstab(assigned['topic'], assigned['pop_unpop'], normalize='columns')
+
+
+def save_model(model, terms, settings: dict, path: str) -> None:
+    """
+    Pickle a trained model with the terms and settings its corpus was built with, so it
+    can be updated with update_topics after a restart
+    """
+    with fileio.atomic_path(path) as tmp_path, open(tmp_path, 'wb') as f:
+        pickle.dump({'model': model, 'terms': list(terms), 'settings': settings}, f)
+
+
+def load_model(path: str) -> tuple:
+    """
+    (model, terms, settings) saved with save_model
+    """
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    return saved['model'], saved['terms'], saved['settings']
+
+
+def run_topics(df: pd.DataFrame, n_topics: int = 5, cache_dir: str = 'topic_cache', text_column: str = 'title', settings: dict = None, workers: int = -1, seed: int = 42) -> tuple:
+    """
+    Corpus (cached), LDA model and topic assignments of a cleaned video frame.
+
+    Returns (frame with topic columns, model, terms).
+    """
+    settings = corpus_settings() if settings is None else settings
+    matrix, terms, _ = cached_corpus(df, cache_dir, text_column, settings)
+    model = train_topics(matrix, n_topics, workers=workers, seed=seed)
+    return assign_topics(df, model, matrix), model, terms
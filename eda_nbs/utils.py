@@ -1,7 +1,33 @@
+import ast
+import re
+
 import isodate
+import numpy as np
 import pandas as pd
 from dateutil import parser
 
+from instrumentation import instrumented
+
+# ISO-8601 duration as returned by the YouTube API, e.g. PT1H2M3S, P1DT2H, P0D
+DURATION_PATTERN = (r'^P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?'
+                    r'(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?'
+                    r'(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$')
+DURATION_UNIT_SECS = {'weeks': 604800, 'days': 86400,
+                      'hours': 3600, 'minutes': 60, 'seconds': 1}
+
+# UTC offset after the time of a timestamp, e.g. the Z of 2020-06-01T10:00:00Z or +02:00
+TIMEZONE_PATTERN = r'(:\d{2}(?:\.\d+)?)\s*(?:Z|[+-]\d{2}:?\d{2})$'
+
+# Columns that compact_dtypes stores as categoricals and as float32
+COMPACT_CATEGORY_COLUMNS = ['channelTitle', 'publishDayName', 'publishingMonthName',
+                            'definition', 'caption', 'tagsstr']
+COMPACT_FLOAT_COLUMNS = ['likeRatio', 'commentRatio']
+
+# Stringified list of plain quoted tags, e.g. ['tag one', "it's"]
+TAG_PATTERN = re.compile(r"'([^'\\]*)'|\"([^\"\\]*)\"")
+TAG_LIST_PATTERN = re.compile(
+    r"\[(?:(?:'[^'\\]*'|\"[^\"\\]*\")(?:, (?:'[^'\\]*'|\"[^\"\\]*\"))*)?\]")
+
 
 def add_pop_unpop_col(df: pd.DataFrame, pop: bool) -> pd.DataFrame:
     """
@@ -14,6 +40,7 @@ def add_pop_unpop_col(df: pd.DataFrame, pop: bool) -> pd.DataFrame:
     return df
 
 
+@instrumented()
 def combine_pop_unpop_df(pop_df: pd.DataFrame, unpop_df: pd.DataFrame) -> pd.DataFrame:
     """
     Combine popular and unpopular dataframes into one dataframe
@@ -22,28 +49,75 @@ def combine_pop_unpop_df(pop_df: pd.DataFrame, unpop_df: pd.DataFrame) -> pd.Dat
     return df
 
 
-def split_and_merge_by_views(df):
-    # Split the original dataframe into two based on 'pop_unpop'
-    df_pop = df[df['pop_unpop'] == 1]
-    df_unpop = df[df['pop_unpop'] == 0]
+def assign_cohorts(df, column, group_column='pop_unpop', quantiles=None):
+    """
+    Cohort code of every row, comparing its value to the thresholds of its group.
+
+    Parameters:
+    - df: Frame with one row per channel or video.
+    - column: Numeric column that is compared, e.g. 'viewCount'.
+    - group_column: Column the thresholds are computed per, e.g. 'pop_unpop'.
+    - quantiles: Optional list of quantiles used as thresholds, e.g. [.25, .5, .75].
+      By default the group mean is the only threshold.
 
-    # Calculate the average number of views for each group
-    avg_views_pop = df_pop['views'].mean()
-    avg_views_unpop = df_unpop['views'].mean()
+    Returns:
+    - codes: int8 Series aligned with df, the number of thresholds the value is greater
+      than or equal to (0 = below the mean, 1 = above or equal for the default),
+      -1 where the value or group is missing.
+    - thresholds: DataFrame with one row per group and one column per threshold.
+    """
+    group_codes, groups = pd.factorize(df[group_column], sort=True)
+    values = df[column]
+
+    # All thresholds of all groups in one groupby pass
+    grouped = values.groupby(group_codes)
+    if quantiles is None:
+        table = grouped.mean().to_frame('mean')
+    else:
+        table = grouped.quantile(list(quantiles)).unstack(level=-1)
+    table = table.reindex(range(len(groups)))
+    table.index = groups
 
-    # Function to create chunks based on average views
-    def create_chunks(df, avg_views):
-        chunk1 = df[df['views'] < avg_views]
-        chunk2 = df[df['views'] >= avg_views]
-        return chunk1, chunk2
+    thresholds = table.to_numpy()[group_codes]
+    codes = (values.to_numpy()[:, None] >= thresholds).sum(axis=1).astype('int8')
+    codes[(group_codes == -1) | values.isna().to_numpy()] = -1
 
-    # Create chunks for popular and unpopular dataframes
-    chunk1_pop, chunk2_pop = create_chunks(df_pop, avg_views_pop)
-    chunk1_unpop, chunk2_unpop = create_chunks(df_unpop, avg_views_unpop)
+    return pd.Series(codes, index=df.index, name='cohort'), table
 
-    # Merge the chunks together
-    chunk_combined_low_views = pd.concat([chunk1_pop, chunk1_unpop])
-    chunk_combined_high_views = pd.concat([chunk2_pop, chunk2_unpop])
+
+@instrumented()
+def channel_cohorts(df, column='viewCount', quantiles=None, channel_column='channelTitle'):
+    """
+    Sum column per channel and assign every channel a cohort within its pop_unpop group
+    with assign_cohorts. Returns the channel totals with a 'cohort' column and the
+    thresholds per pop_unpop group.
+
+    Videos can be labelled with the cohort of their channel through
+    df[channel_column].map(channels.set_index(channel_column)['cohort']).
+    """
+    channels = df.groupby([channel_column, 'pop_unpop'], as_index=False, observed=True)[
+        column].sum()
+    # Categorical keys come back in order of appearance, sort them like string keys
+    channels = channels.sort_values([channel_column, 'pop_unpop'], ignore_index=True)
+    codes, thresholds = assign_cohorts(channels, column, 'pop_unpop', quantiles)
+    channels['cohort'] = codes
+    return channels, thresholds
+
+
+@instrumented()
+def split_and_merge_by_views(df):
+    """
+    Split channels into the ones below and the ones above or equal to the mean 'views'
+    of their pop_unpop group, popular channels first in both frames
+    """
+    codes = assign_cohorts(df, 'views')[0].to_numpy()
+
+    # Popular rows first, then unpopular rows, each in their original order
+    pop_unpop = df['pop_unpop'].to_numpy()
+    order = np.concatenate([np.flatnonzero(pop_unpop == 1), np.flatnonzero(pop_unpop == 0)])
+
+    chunk_combined_low_views = df.iloc[order[codes[order] == 0]]
+    chunk_combined_high_views = df.iloc[order[codes[order] == 1]]
 
     return chunk_combined_low_views, chunk_combined_high_views
 
@@ -66,6 +140,31 @@ def parse_count(x):
         return None
 
 
+def parse_tags(x):
+    # Fast path for lists without escape sequences, anything else goes through literal_eval
+    if TAG_LIST_PATTERN.fullmatch(x):
+        return [single or double for single, double in TAG_PATTERN.findall(x)]
+    try:
+        tags = ast.literal_eval(x)
+    except (ValueError, SyntaxError):
+        # print(f"Could not decode tags: {x}")
+        return []
+    return list(tags) if isinstance(tags, (list, tuple)) else []
+
+
+def decode_tags(tags: pd.Series) -> pd.Series:
+    """
+    Decode the stringified tag lists (e.g. "['a', 'b']") into real lists without eval.
+    Missing values and 'nan' become an empty list. Every distinct string is decoded once
+    and rows with identical tags share the same list object, so don't mutate them in place.
+    """
+    codes, uniques = pd.factorize(tags.astype(str))
+    decoded = [[] if x in ('0', 'nan', 'None') else parse_tags(x)
+               for x in uniques]
+    return pd.Series([decoded[code] for code in codes], index=tags.index, dtype=object)
+
+
+@instrumented()
 def parse_cols(df: pd.DataFrame) -> pd.DataFrame:
     # Print total rows before parsing
     total_rows_before = len(df)
@@ -108,8 +207,8 @@ def parse_cols(df: pd.DataFrame) -> pd.DataFrame:
     # Parse the tags column
     # tags were not in proper format so converting them to str
     df['tagsstr'] = df.tags.apply(lambda x: 0 if x is None else str((x)))
-    df['tagsCount'] = df.tagsstr.apply(
-        lambda x: 0 if (x == 0 or x == 'nan') else len(eval(x)))
+    df['tagsList'] = decode_tags(df['tagsstr'])
+    df['tagsCount'] = df['tagsList'].str.len()
     df.drop(['tags'], axis=1, inplace=True)
 
     # Apply the parsing function to the 'viewCount' column
@@ -138,56 +237,182 @@ def parse_cols(df: pd.DataFrame) -> pd.DataFrame:
 
     return df
 
-# def remove_outliers(df, channel_column='channelTitle', year_column='publishingYear', month_column='publishingMonthName', column='viewCount', threshold=1.5):
-#     """
-#     Remove outliers for each channel, for each month, and for all years.
 
-#     Parameters:
-#     - df: DataFrame containing the data.
-#     - channel_column: Name of the column containing channel titles.
-#     - year_column: Name of the column containing publishing years.
-#     - month_column: Name of the column containing publishing months.
-#     - column: Name of the column containing view counts.
-#     - threshold: Threshold for detecting outliers (default is 1.5).
+def parse_duration_secs(durations: pd.Series) -> pd.Series:
+    """
+    Convert a column of ISO-8601 durations into seconds without a per-row isodate call.
+    Values that do not match the pattern become NaN.
+    """
+    parts = durations.astype(str).str.extract(DURATION_PATTERN)
+    parts = parts.apply(pd.to_numeric, errors='coerce')
+    secs = sum(parts[unit].fillna(0) * factor
+               for unit, factor in DURATION_UNIT_SECS.items())
+    # A non-matching value yields NaN in every group
+    return secs.where(parts.notna().any(axis=1))
+
+
+def parse_cols_with_counts(df: pd.DataFrame):
+    """
+    Quiet version of parse_cols_vectorized for callers that parse a file in pieces.
+
+    Returns the parsed frame and a dict with the counts parse_cols prints:
+    rows_before, dropped_published_at, dropped_view_count and rows_after.
+    The counts of several chunks can be summed and shown with print_parse_counts.
+    """
+    counts = {'rows_before': len(df)}
+
+    # Drop the UTC offset before parsing and keep the local clock time, like
+    # parse_published_at: 2020-06-01T10:00:00+02:00 is 10:00, not 08:00 UTC
+    df['publishedAt'] = pd.to_datetime(
+        df['publishedAt'].astype(str).str.replace(TIMEZONE_PATTERN, r'\1', regex=True),
+        errors='coerce')
+
+    # Count the rows with parsing errors
+    counts['dropped_published_at'] = int(df['publishedAt'].isna().sum())
+
+    # Remove rows where 'publishedAt' is not parsed
+    df = df.dropna(subset=['publishedAt']).copy()
+
+    # Create publish day (in the week) column
+    df['publishDayName'] = df['publishedAt'].dt.day_name()
+
+    # Extract year, month, and time into separate columns
+    df['publishingYear'] = df['publishedAt'].dt.year
+    df['publishingMonth'] = df['publishedAt'].dt.month
+    df['publishingTime'] = df['publishedAt'].dt.time
+
+    # Get month name
+    df['publishingMonthName'] = df['publishedAt'].dt.month_name()
+
+    # Dropping the 'publishedAt' column
+    df.drop(['publishedAt'], axis=1, inplace=True)
+
+    # Parse the duration column
+    df['durationSecs'] = parse_duration_secs(df['duration'])
+    df.drop(['duration'], axis=1, inplace=True)
+
+    # Parse the tags column
+    # tags were not in proper format so converting them to str
+    df['tagsstr'] = df.tags.apply(lambda x: 0 if x is None else str((x)))
+    df['tagsList'] = decode_tags(df['tagsstr'])
+    df['tagsCount'] = df['tagsList'].str.len()
+    df.drop(['tags'], axis=1, inplace=True)
+
+    # Parse the count columns, anything non-numeric becomes NaN
+    for col in ['viewCount', 'likeCount', 'commentCount']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Count the rows where 'viewCount' is a string
+    counts['dropped_view_count'] = int(df['viewCount'].isna().sum())
+
+    # Remove rows where 'viewCount' is 0
+    df = df[df['viewCount'] != 0].copy()
+
+    # Comments and likes per 1000 view ratio
+    df['likeRatio'] = (df['likeCount'] / df['viewCount']) * 1000
+    df['commentRatio'] = (df['commentCount'] / df['viewCount']) * 1000
+
+    # Title character length
+    df['titleLength'] = df['title'].str.len()
+
+    counts['rows_after'] = len(df)
+    return df, counts
+
+
+def print_parse_counts(counts: dict) -> None:
+    """
+    Print the parsing summary of parse_cols from the counts of parse_cols_with_counts
+    """
+    print(f"Total rows before parsing: {counts['rows_before']}")
+    print(
+        f"Parser dropped {counts['dropped_published_at']} rows during 'publishedAt' parsing")
+    print(
+        f"Parser dropped {counts['dropped_view_count']} rows during 'viewCount' parsing")
+    print(f"Total rows after parsing: {counts['rows_after']}")
+
 
-#     Returns:
-#     - DataFrame with outliers removed.
-#     """
-#     df_no_outliers = pd.DataFrame()
+@instrumented()
+def parse_cols_vectorized(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Columnar version of parse_cols that produces the same columns and row counts,
+    but parses every column with one vectorized pandas call instead of a per-row apply.
+    """
+    df, counts = parse_cols_with_counts(df)
+    print_parse_counts(counts)
+    return df
 
-#     # Iterate over unique channels
-#     for channel in df[channel_column].unique():
-#         channel_df = df[df[channel_column] == channel]
 
-#         # Iterate over unique years
-#         for year in channel_df[year_column].unique():
-#             year_df = channel_df[channel_df[year_column] == year]
+def smallest_integer_dtype(values: pd.Series):
+    """
+    Smallest integer dtype holding all values, nullable (e.g. 'Int32') when there are NaNs.
+    Returns None when the values are not whole numbers.
+    """
+    present = values.dropna()
+    if len(present) and not (present % 1 == 0).all():
+        return None
+    low, high = (present.min(), present.max()) if len(present) else (0, 0)
+    for bits in (8, 16, 32, 64):
+        info = np.iinfo(f'int{bits}')
+        if info.min <= low and high <= info.max:
+            return f'Int{bits}' if len(present) < len(values) else f'int{bits}'
+    return None
 
-#             # Iterate over unique months
-#             for month in year_df[month_column].unique():
-#                 month_df = year_df[year_df[month_column] == month]
 
-#                 # Calculate the IQR (Interquartile Range)
-#                 q1 = month_df[column].quantile(0.25)
-#                 q3 = month_df[column].quantile(0.75)
-#                 iqr = q3 - q1
+@instrumented()
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Opt-in memory-compact copy of a parsed video frame:
+    - repeated strings (channel, day and month names, definition, caption, tagsstr) stored
+      as objects become categoricals
+    - whole-number columns (counts, year, month, duration, ...) are downcast to the smallest
+      integer type, nullable when they contain NaN
+    - publishingTime (datetime.time objects) is replaced by publishingTimeSecs, seconds since midnight
+    - like and comment ratios become float32
+
+    The input frame is left untouched.
+    """
+    df = df.copy(deep=False)
+
+    for column in COMPACT_CATEGORY_COLUMNS:
+        if column in df.columns and df[column].dtype == object:
+            df[column] = df[column].astype('category')
+
+    for column in df.select_dtypes('number').columns:
+        if column in COMPACT_FLOAT_COLUMNS:
+            df[column] = df[column].astype('float32')
+            continue
+        dtype = smallest_integer_dtype(df[column])
+        if dtype is not None:
+            df[column] = df[column].astype(dtype)
+
+    if 'publishingTime' in df.columns:
+        secs = np.fromiter((t.hour * 3600 + t.minute * 60 + t.second for t in df['publishingTime']),
+                           dtype=np.int32, count=len(df))
+        position = df.columns.get_loc('publishingTime')
+        df = df.drop(columns='publishingTime')
+        df.insert(position, 'publishingTimeSecs', secs)
 
-#                 # Define the upper and lower bounds to identify outliers
-#                 lower_bound = q1 - threshold * iqr
-#                 upper_bound = q3 + threshold * iqr
+    return df
 
-#                 # Remove outliers
-#                 month_df_no_outliers = month_df[(month_df[column] >= lower_bound) & (
-#                     month_df[column] <= upper_bound)]
 
-#                 # Append the result to the final DataFrame
-#                 df_no_outliers = pd.concat(
-#                     [df_no_outliers, month_df_no_outliers])
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-column memory usage in MB of a parsed frame before and after compact_dtypes,
+    with a 'total' row at the bottom. publishingTimeSecs is reported as publishingTime.
+    """
+    before = df.memory_usage(deep=True, index=False)
+    after = compact_dtypes(df).memory_usage(deep=True, index=False)
+    after = after.rename({'publishingTimeSecs': 'publishingTime'})
 
-#     return df_no_outliers
+    report = pd.DataFrame({'before_MB': before, 'after_MB': after}) / 1_000_000
+    report.loc['total'] = report.sum()
+    report['saved_MB'] = report['before_MB'] - report['after_MB']
+    report['saved_pct'] = report['saved_MB'] / report['before_MB'] * 100
+    return report.round(3)
 
 
-def remove_outliers(df, channel_column='channelTitle', year_column='publishingYear', column='viewCount', threshold=1.5):
+@instrumented()
+def remove_outliers(df, channel_column='channelTitle', year_column='publishingYear', column='viewCount', threshold=1.5, extra_columns=None):
     """
     Remove outliers for each channel and each year.
 
@@ -197,109 +422,102 @@ def remove_outliers(df, channel_column='channelTitle', year_column='publishingYe
     - year_column: Name of the column containing publishing years.
     - column: Name of the column containing view counts.
     - threshold: Threshold for detecting outliers (default is 1.5).
+    - extra_columns: Optional list of further grouping columns, e.g. ['publishingMonthName']
+      to remove outliers for each channel, for each month, and for all years.
 
     Returns:
-    - DataFrame with outliers removed.
+    - DataFrame with outliers removed, ordered by channel, then year (then extra columns)
+      in order of first appearance, keeping the original row order inside each group.
     """
-    df_no_outliers = pd.DataFrame()
+    group_columns = [channel_column, year_column] + list(extra_columns or [])
+    grouped = df.groupby(group_columns, sort=False)[column]
 
-    # Iterate over unique channels
-    for channel in df[channel_column].unique():
-        channel_df = df[df[channel_column] == channel]
+    # Calculate the IQR (Interquartile Range) of every group in one pass
+    q1 = grouped.transform('quantile', 0.25)
+    q3 = grouped.transform('quantile', 0.75)
+    iqr = q3 - q1
 
-        # Iterate over unique years
-        for year in channel_df[year_column].unique():
-            year_df = channel_df[channel_df[year_column] == year]
+    # Define the upper and lower bounds to identify outliers
+    lower_bound = q1 - threshold * iqr
+    upper_bound = q3 + threshold * iqr
 
-            # Calculate the IQR (Interquartile Range)
-            q1 = year_df[column].quantile(0.25)
-            q3 = year_df[column].quantile(0.75)
-            iqr = q3 - q1
+    # Remove outliers
+    mask = (df[column] >= lower_bound) & (df[column] <= upper_bound)
 
-            # Define the upper and lower bounds to identify outliers
-            lower_bound = q1 - threshold * iqr
-            upper_bound = q3 + threshold * iqr
+    # Order the rows group by group like the former per-channel, per-year loop did
+    sort_keys = [np.arange(len(df))]
+    for i in range(len(group_columns), 0, -1):
+        sort_keys.append(df.groupby(group_columns[:i], sort=False).ngroup().to_numpy())
+    order = np.lexsort(sort_keys)
 
-            # Remove outliers
-            year_df_no_outliers = year_df[(year_df[column] >= lower_bound) & (
-                year_df[column] <= upper_bound)]
+    return df.iloc[order[mask.to_numpy(dtype=bool, na_value=False)[order]]]
 
-            # Append the result to the final DataFrame
-            df_no_outliers = pd.concat(
-                [df_no_outliers, year_df_no_outliers])
 
-    return df_no_outliers
+@instrumented()
+def pop_unpop_chunks(df):
+    """
+    Total views per channel, the mean total of popular and unpopular channels and the
+    channel names below and above (or equal to) the mean of their group
+    """
+    channels, thresholds = channel_cohorts(df, 'viewCount')
+    summed_views_df = channels.drop(columns='cohort')
 
+    mean_views = thresholds['mean']
+    mean_views_popular = mean_views.get(1, np.nan)
+    mean_views_unpopular = mean_views.get(0, np.nan)
 
-def pop_unpop_chunks(df):
-    # Step 1: Sum up views for each channel
-    summed_views_df = df.groupby(['channelTitle', 'pop_unpop'], as_index=False)[
-        'viewCount'].sum()
-
-    # Step 2: Find mean views for popular and unpopular channels
-    mean_views_popular = summed_views_df[summed_views_df['pop_unpop'] == 1]['viewCount'].mean(
-    )
-    mean_views_unpopular = summed_views_df[summed_views_df['pop_unpop'] == 0]['viewCount'].mean(
-    )
-
-    # Step 3: Create lists based on mean views
-    popular_channels = summed_views_df[summed_views_df['pop_unpop']
-                                       == 1]['channelTitle']
-    unpopular_channels = summed_views_df[summed_views_df['pop_unpop']
-                                         == 0]['channelTitle']
-
-    # Separate channels based on mean views
-    popular_below_mean = popular_channels[summed_views_df[summed_views_df['pop_unpop']
-                                                          == 1]['viewCount'] < mean_views_popular].tolist()
-    popular_above_mean = popular_channels[summed_views_df[summed_views_df['pop_unpop']
-                                                          == 1]['viewCount'] >= mean_views_popular].tolist()
-
-    unpopular_below_mean = unpopular_channels[summed_views_df[summed_views_df['pop_unpop']
-                                                              == 0]['viewCount'] < mean_views_unpopular].tolist()
-    unpopular_above_mean = unpopular_channels[summed_views_df[summed_views_df['pop_unpop']
-                                                              == 0]['viewCount'] >= mean_views_unpopular].tolist()
+    # Channel names per (pop_unpop, cohort), in the order of summed_views_df
+    names = channels.groupby(['pop_unpop', 'cohort'])['channelTitle'].agg(list)
+
+    def cohort_names(pop_unpop, cohort):
+        return list(names.get((pop_unpop, cohort), []))
+
+    popular_below_mean = cohort_names(1, 0)
+    popular_above_mean = cohort_names(1, 1)
+    unpopular_below_mean = cohort_names(0, 0)
+    unpopular_above_mean = cohort_names(0, 1)
 
     return summed_views_df, mean_views_popular, mean_views_unpopular, popular_below_mean, popular_above_mean, unpopular_below_mean, unpopular_above_mean
 
 
+@instrumented()
 def calculate_percentiles_df(df, percentiles, year_column='publishingYear', column='viewCount'):
-    percentiles_data_popular = {percentile: {} for percentile in percentiles}
-    percentiles_data_unpopular = {percentile: {} for percentile in percentiles}
-
-    for channel in df.channelTitle.unique():
-        channel_df = df[df['channelTitle'] == channel]
-        for year in channel_df[year_column].unique():
-            year_df = channel_df[channel_df[year_column] == year]
-            for percentile in percentiles:
-                if percentile not in percentiles_data_popular:
-                    percentiles_data_popular[percentile] = {}
-                if channel not in percentiles_data_popular[percentile]:
-                    percentiles_data_popular[percentile][channel] = {}
-                if channel_df['pop_unpop'].iloc[0] == 0:
-                    # Unpopular channel
-                    if percentile not in percentiles_data_unpopular:
-                        percentiles_data_unpopular[percentile] = {}
-                    if channel not in percentiles_data_unpopular[percentile]:
-                        percentiles_data_unpopular[percentile][channel] = {}
-                    value = year_df[column].quantile(
-                        float(percentile)) / 1_000_000  # Convert to millions
-                    percentiles_data_unpopular[percentile][channel][year] = value
-                else:
-                    # Popular channel
-                    value = year_df[column].quantile(
-                        float(percentile)) / 1_000_000  # Convert to millions
-                    percentiles_data_popular[percentile][channel][year] = value
+    """
+    Calculate the given percentiles of a column (in millions) for every channel and year.
 
-    # Create DataFrames for popular and unpopular channels
-    df_percentiles_popular = pd.DataFrame.from_dict({(i, j): percentiles_data_popular[i][j]
-                                                     for i in percentiles_data_popular.keys()
-                                                     for j in percentiles_data_popular[i].keys()},
-                                                    orient='index')
+    All percentiles of all (channel, year) groups are computed with a single
+    groupby().quantile() call, the tables are then built from them like before.
 
-    df_percentiles_unpopular = pd.DataFrame.from_dict({(i, j): percentiles_data_unpopular[i][j]
-                                                       for i in percentiles_data_unpopular.keys()
-                                                       for j in percentiles_data_unpopular[i].keys()},
-                                                      orient='index')
+    Returns:
+    - df_percentiles_popular, df_percentiles_unpopular: years as rows and
+      (percentile, channelTitle) as columns, in the same order as the former
+      per-channel, per-year loop gave.
+    """
+    quantiles = [float(percentile) for percentile in percentiles]
+    values = df.groupby(['channelTitle', year_column], sort=False, observed=True)[
+        column].quantile(quantiles) / 1_000_000  # Convert to millions
+
+    # A channel is popular unless its first row is marked as unpopular
+    popular = df.groupby('channelTitle', sort=False, observed=True)[
+        'pop_unpop'].first() != 0
+
+    # {(percentile, channel): {year: value}} with channels and their years in order of
+    # first appearance, so from_dict orders rows and columns like the former loop
+    channels = values.index.unique(level=0)
+    percentiles_data_popular = {}
+    percentiles_data_unpopular = {}
+    for percentile, quantile in zip(percentiles, quantiles):
+        years = {channel: group.droplevel(0).to_dict()
+                 for channel, group in values.xs(quantile, level=-1).groupby(level=0)}
+        for channel in channels:
+            data = percentiles_data_popular if popular[channel] else percentiles_data_unpopular
+            data[(percentile, channel)] = years[channel]
+
+    # Create DataFrames for popular and unpopular channels
+    df_percentiles_popular = pd.DataFrame.from_dict(
+        percentiles_data_popular, orient='index')
+    df_percentiles_unpopular = pd.DataFrame.from_dict(
+        percentiles_data_unpopular, orient='index')
 
     # Transpose the DataFrames for better readability
     df_percentiles_popular = df_percentiles_popular.transpose()
@@ -308,13 +526,23 @@ def calculate_percentiles_df(df, percentiles, year_column='publishingYear', colu
     return df_percentiles_popular, df_percentiles_unpopular
 
 
+def mean_of_describe(df):
+    """
+    Same result as df.describe().describe().loc[['mean']], i.e. the mean of every column's
+    summary statistics, but computed for all columns at once instead of column by column.
+    """
+    stats = pd.concat([df.count(), df.mean(), df.std(), df.min(),
+                       *[df.quantile(q) for q in (0.25, 0.5, 0.75)], df.max()], axis=1)
+    return stats.mean(axis=1).to_frame('mean').transpose()
+
+
+@instrumented()
 def return_means_from_percentiles_for_given_years(df, percentiles, years, year_column='publishingYear', column='viewCount'):
     df_percentiles_popular, df_percentiles_unpopular = calculate_percentiles_df(
         df, percentiles, year_column, column)
 
     # Calculate means for popular channels
-    means_popular = df_percentiles_popular.loc[years].describe()
-    means_popular = means_popular.describe().loc[['mean']]
+    means_popular = mean_of_describe(df_percentiles_popular.loc[years])
     means_popular = means_popular.rename(index={'mean': 'ViewMean'})
     means_popular = means_popular.transpose()
     means_popular = means_popular.sort_values(by='ViewMean', ascending=True)
@@ -324,8 +552,7 @@ def return_means_from_percentiles_for_given_years(df, percentiles, years, year_c
     means_popular['cumulative_average'] = means_popular['ViewMean'].expanding().mean()
 
     # Repeat for unpopular channels
-    means_unpopular = df_percentiles_unpopular.loc[years].describe()
-    means_unpopular = means_unpopular.describe().loc[['mean']]
+    means_unpopular = mean_of_describe(df_percentiles_unpopular.loc[years])
     means_unpopular = means_unpopular.rename(index={'mean': 'ViewMean'})
     means_unpopular = means_unpopular.transpose()
     means_unpopular = means_unpopular.sort_values(